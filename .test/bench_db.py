@@ -0,0 +1,80 @@
+"""
+Database micro-benchmark: connection per operation vs the persistent Database connection.
+
+Updates go through the write-behind queue, so one awaited update at a time mostly measures the
+flush delay; the batched line queues every update at once, like concurrent handlers do.
+
+Run from the repository root:  python .test/bench_db.py [operations]
+"""
+
+import asyncio, os, sys, tempfile, time
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.libraries.cache import UserCache
+from modules.libraries.dbms import Database
+
+USERS = 1000
+OPS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+async def fetch_per_connection(path: str, user_id: int):
+    async with aiosqlite.connect(path) as db:
+        async with db.cursor() as cursor:
+            await cursor.execute("SELECT * FROM users WHERE user_id =?", (user_id,))
+            return await cursor.fetchone()
+
+
+async def update_per_connection(path: str, user_id: int, value: int):
+    async with aiosqlite.connect(path) as db:
+        async with db.cursor() as cursor:
+            await cursor.execute("UPDATE users SET last_rate =? WHERE user_id =?", (value, user_id))
+            await db.commit()
+
+
+async def measure(name: str, operation) -> float:
+    start = time.perf_counter()
+    for i in range(OPS):
+        await operation(i % USERS)
+    ops = OPS / (time.perf_counter() - start)
+    print(f"{name:<32}{ops:>12.0f} ops/sec")
+    return ops
+
+
+async def measure_batched(name: str, operation) -> float:
+    start = time.perf_counter()
+    results = await asyncio.gather(*(operation(i % USERS) for i in range(OPS)))
+    ops = OPS / (time.perf_counter() - start)
+    assert all(results), "some queued updates failed"
+    print(f"{name:<32}{ops:>12.0f} ops/sec")
+    return ops
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        database = Database(path)
+        await database.create_tables()
+        for user_id in range(USERS):
+            await database.add_user(user_id, f"user{user_id}")
+        await database.close()
+
+        before_fetch = await measure("fetch, connect per op", lambda user_id: fetch_per_connection(path, user_id))
+        before_update = await measure("update, connect per op", lambda user_id: update_per_connection(path, user_id, user_id))
+
+        database = Database(path)
+        # Without the user cache, so this line measures the persistent connection itself
+        database.users = UserCache(max_size=0)
+        after_fetch = await measure("fetch, persistent", database.fetch_info)
+        database.users = UserCache()
+        await measure("fetch, persistent + user cache", database.fetch_info)
+        await measure("update, one at a time", lambda user_id: database.info_updater(user_id, "last_rate", user_id))
+        after_update = await measure_batched("update, batched", lambda user_id: database.queue_update(user_id, "last_rate", -user_id))
+        await database.close()
+
+        print(f"fetch speedup:  {after_fetch / before_fetch:.1f}x")
+        print(f"update speedup: {after_update / before_update:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
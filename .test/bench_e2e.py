@@ -0,0 +1,162 @@
+"""
+End-to-end load benchmark: the real router against local Telegram Bot API and Coinbase stand-ins.
+
+Every synthetic user sends /start, /get_rate, /set_currency <code> and /forecast. Forecasts are
+seeded into the cache beforehand, so /forecast measures the cache-hit path users normally take.
+Telegram's send limits are lifted, so the numbers are about the bot and not about the limiter.
+Prints one JSON document: throughput, p50/p99 latency per command, DB statements and outbound
+HTTP calls per update.
+
+Run from the repository root:  python .test/bench_e2e.py [--users N] [--concurrency N] [--output FILE]
+"""
+
+import argparse, asyncio, json, os, random, sys, tempfile, time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.libraries.utils import const
+
+# Must be set before the modules that read them as defaults are imported
+directory = tempfile.mkdtemp()
+const.DATABASE_NAME = os.path.join(directory, "bench.db")
+const.FORECAST_CACHE_DIR = os.path.join(directory, "forecasts")
+const.SYMBOL_CATALOG_PATH = os.path.join(directory, "symbols.json")
+const.SEND_GLOBAL_RATE = const.SEND_CHAT_RATE = const.SEND_CHAT_BURST = 10 ** 6
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from modules.handlers import database
+from modules.libraries.cache import forecast_cache, price_cache
+from modules.libraries.sender import send_queue
+from modules.libraries.utils import http_client
+from modules.routers.routers import router
+from fixtures import serve, update
+
+CURRENCIES = ["BTC", "ETH", "SOL", "DOGE"]
+COMMANDS = ["/start", "/get_rate", "/set_currency", "currency", "/forecast"]
+
+
+class FakeTelegram:
+    # Answers Bot API methods the way Telegram does, just enough for the handlers
+
+    def __init__(self):
+        self.calls = Counter()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        form = await request.post()
+        result = {"message_id": self.calls[method], "date": int(time.time()), "chat": {"id": int(form.get("chat_id", 0)), "type": "private"}}
+        if method.lower() == "sendphoto":
+            result["photo"] = [{"file_id": "bench-file-id", "file_unique_id": "bench", "width": 1, "height": 1}]
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeCoinbase:
+
+    def __init__(self):
+        self.calls = Counter()
+
+    async def spot(self, request: web.Request) -> web.Response:
+        self.calls["spot"] += 1
+        base = request.match_info["pair"].split("-")[0]
+        return web.json_response({"data": {"base": base, "currency": "USD", "amount": f"{random.uniform(100, 200):.2f}"}})
+
+    async def exchange_rates(self, request: web.Request) -> web.Response:
+        self.calls["exchange_rates"] += 1
+        rates = {currency: f"{1 / random.uniform(100, 200):.8f}" for currency in CURRENCIES}
+        return web.json_response({"data": {"currency": request.query.get("currency", "USD"), "rates": rates}})
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def main(args):
+    telegram, coinbase = FakeTelegram(), FakeCoinbase()
+    telegram_app = web.Application()
+    telegram_app.router.add_post("/bot{token}/{method}", telegram.handle)
+    coinbase_app = web.Application()
+    coinbase_app.router.add_get("/v2/prices/{pair}/spot", coinbase.spot)
+    coinbase_app.router.add_get("/v2/exchange-rates", coinbase.exchange_rates)
+    telegram_runner, telegram_url = await serve(telegram_app)
+    coinbase_runner, coinbase_url = await serve(coinbase_app)
+    const.COINBASE_API_URL = coinbase_url
+
+    await database.create_tables()
+    statements = Counter()
+    connection = await database.connection()
+    await connection.set_trace_callback(lambda sql: statements.update([sql.split(None, 1)[0].upper()]))
+    for currency in CURRENCIES:
+        forecast_cache.put(f"{currency}-USD", "1d", 60, "123.45", b"\x89PNG bench chart")
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token="42:BENCH", session=AiohttpSession(api=TelegramAPIServer.from_base(telegram_url)))
+
+    latencies = defaultdict(list)
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def conversation(user_id: int):
+        currency = CURRENCIES[user_id % len(CURRENCIES)]
+        async with limit:
+            for step, command in enumerate(COMMANDS):
+                text = currency if command == "currency" else command
+                started = time.perf_counter()
+                await dp.feed_update(bot, update(user_id * 10 + step, user_id, text))
+                latencies[command].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    # One task per conversation, as aiogram does for polled updates
+    await asyncio.gather(*(asyncio.create_task(conversation(user_id)) for user_id in range(1, args.users + 1)))
+    await database.flush()
+    elapsed = time.perf_counter() - started
+
+    updates = sum(len(values) for values in latencies.values())
+    everything = [value for values in latencies.values() for value in values]
+    report = {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "updates": updates,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(updates / elapsed, 1),
+        "latency_ms": {
+            command: {
+                "p50": round(percentile(values, 0.5) * 1000, 3),
+                "p99": round(percentile(values, 0.99) * 1000, 3),
+            }
+            for command, values in [("all", everything), *latencies.items()]
+        },
+        "db_statements": dict(statements),
+        "db_statements_per_update": round(sum(statements.values()) / updates, 3),
+        "telegram_calls": dict(telegram.calls),
+        "telegram_calls_per_update": round(sum(telegram.calls.values()) / updates, 3),
+        "coinbase_calls": dict(coinbase.calls),
+        "coinbase_calls_per_update": round(sum(coinbase.calls.values()) / updates, 3),
+        "user_cache": database.users.stats(),
+        "price_cache": price_cache.stats(),
+    }
+
+    await send_queue.stop()
+    await bot.session.close()
+    await http_client.close()
+    await database.close()
+    await telegram_runner.cleanup()
+    await coinbase_runner.cleanup()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200, help="conversations in flight at once")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    asyncio.run(main(parser.parse_args()))
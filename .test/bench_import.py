@@ -0,0 +1,55 @@
+"""
+Startup import-time budget check.
+
+Run from the repository root:  python .test/bench_import.py [budget_ms]
+Exits with status 1 if importing the bot modules takes longer than the budget
+or pulls in the forecasting stack eagerly.
+"""
+
+import os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["modules.routers.routers", "modules.libraries.scheduler", "modules.libraries.workers"]
+FORBIDDEN = ["yfinance", "matplotlib", "sklearn", "pandas"]
+BUDGET_MS = float(sys.argv[1]) if len(sys.argv) > 1 else 1500
+RUNS = 3
+
+
+def measure() -> tuple:
+    code = "; ".join(f"import {module}" for module in MODULES)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"Import failed:\n{result.stderr}")
+
+    # "import time: <self us> | <cumulative us> | <indent><module>", indent is two spaces per level
+    top_level, imported = {}, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, total_us, name = line[len("import time:"):].split("|")
+        imported.add(name.strip().split(".")[0])
+        if len(name) - len(name.lstrip()) == 1:
+            top_level[name.strip()] = int(total_us)
+    return sum(top_level.values()) / 1000, top_level, imported
+
+
+def main():
+    total_ms, top_level, imported = min((measure() for _ in range(RUNS)), key=lambda run: run[0])
+
+    for name, us in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print(f"{us / 1000:9.1f} ms  {name}")
+    print(f"{total_ms:9.1f} ms  total (budget {BUDGET_MS:.0f} ms)")
+
+    eager = [name for name in FORBIDDEN if name in imported]
+    if eager:
+        sys.exit(f"FAIL: heavy modules imported at startup: {', '.join(eager)}")
+    if total_ms > BUDGET_MS:
+        sys.exit(f"FAIL: startup imports took {total_ms:.1f} ms, over the {BUDGET_MS:.0f} ms budget")
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
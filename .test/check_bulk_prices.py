@@ -0,0 +1,85 @@
+"""
+Bulk price refresh with per-symbol fallback.
+
+Serves a fake exchange-rates response with broken and missing entries and checks that the
+PriceCache parses the good ones from the single bulk request and only falls back to per-symbol
+spot requests for symbols the bulk response doesn't price.
+
+Run from the repository root:  python .test/check_bulk_prices.py
+"""
+
+import asyncio, os, sys, tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.libraries.utils import const
+
+const.SYMBOL_CATALOG_PATH = os.path.join(tempfile.mkdtemp(), "symbols.json")
+
+from aiohttp import web
+from modules.libraries.cache import PriceCache
+from modules.libraries.utils import _Methods, http_client
+from fixtures import serve
+
+RATES = {"BTC": "0.00001", "ETH": "0.0005", "BAD": "not a number", "ZERO": "0", "NULL": None}
+SPOT = {"SOL": "149.6", "ZERO": "3"}
+EXPECTED = {"BTC": 100000, "ETH": 2000, "SOL": 150, "ZERO": 3, "GONE": None}
+
+
+class FakeCoinbase:
+
+    def __init__(self):
+        self.calls = Counter()
+
+    async def spot(self, request: web.Request) -> web.Response:
+        base = request.match_info["pair"].split("-")[0]
+        self.calls[f"spot {base}"] += 1
+        if base not in SPOT:
+            return web.json_response({"errors": [{"id": "not_found"}]}, status=404)
+        return web.json_response({"data": {"base": base, "currency": "USD", "amount": SPOT[base]}})
+
+    async def exchange_rates(self, request: web.Request) -> web.Response:
+        self.calls["exchange_rates"] += 1
+        return web.json_response({"data": {"currency": request.query.get("currency", "USD"), "rates": RATES}})
+
+
+async def main():
+    coinbase = FakeCoinbase()
+    app = web.Application()
+    app.router.add_get("/v2/prices/{pair}/spot", coinbase.spot)
+    app.router.add_get("/v2/exchange-rates", coinbase.exchange_rates)
+    runner, const.COINBASE_API_URL = await serve(app)
+
+    errors = []
+    try:
+        parsed = await _Methods.get_exchange_rates()
+        if parsed != {"BTC": 100000, "ETH": 2000}:
+            errors.append(f"bulk parsing kept {parsed}")
+        coinbase.calls.clear()
+
+        cache = PriceCache(_Methods.get_currency_price, _Methods.get_exchange_rates)
+        prices = await cache.get_many(EXPECTED)
+        print(f"prices: {prices}")
+        print(f"requests: {dict(coinbase.calls)}, fallbacks {cache.fallbacks}")
+        if prices != EXPECTED:
+            errors.append(f"expected {EXPECTED}, got {prices}")
+        expected_calls = {"exchange_rates": 1, "spot SOL": 1, "spot ZERO": 1, "spot GONE": 1}
+        if dict(coinbase.calls) != expected_calls:
+            errors.append(f"expected requests {expected_calls}, got {dict(coinbase.calls)}")
+
+        # Everything priced is cached now, so a second round costs nothing
+        coinbase.calls.clear()
+        await cache.get_many(["BTC", "ETH", "SOL"])
+        if coinbase.calls:
+            errors.append(f"cached prices were fetched again: {dict(coinbase.calls)}")
+    finally:
+        await http_client.close()
+        await runner.cleanup()
+
+    if errors:
+        sys.exit("FAIL: " + "; ".join(errors))
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""
+Incremental candle sync.
+
+Syncs a symbol against a fake downloader over several simulated days and checks that only
+missing candles are requested, the still open candle is never stored, and the window before a
+recent listing date is asked for once, but again after a failed download. Every write is a new
+file generation, so views of older candles stay valid and only the newest file is kept.
+
+Run from the repository root:  python .test/check_candles.py
+"""
+
+import os, sys, tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.libraries.candles import CandleStore
+
+DAY = 86400
+LISTED = 100 * DAY  # no candles exist before this
+
+
+class FakeDownloader:
+
+    def __init__(self):
+        self.windows = []
+        self.fail = False
+
+    def __call__(self, symbol: str, start: int, end: int, interval: str):
+        self.windows.append((start // DAY, end // DAY))
+        if self.fail:
+            raise RuntimeError("rate limited")
+        # Like the real source, the open candle is returned too
+        ts = np.arange(max(start, LISTED) // DAY * DAY, end + DAY, DAY, dtype="<i8")
+        ts = ts[ts >= start]
+        return ts, ts / DAY
+
+
+def main():
+    downloader = FakeDownloader()
+    directory = tempfile.mkdtemp()
+    store = CandleStore(path=directory, downloader=downloader)
+    errors = []
+
+    store.sync("NEW-USD", "1d", 90 * DAY, end=120 * DAY + 5)
+    store.sync("NEW-USD", "1d", 90 * DAY, end=120 * DAY + 50)
+    held = store.load("NEW-USD", "1d")[:3]
+    store.sync("NEW-USD", "1d", 90 * DAY, end=122 * DAY + 5)
+    downloader.fail = True
+    store.sync("NEW-USD", "1d", 80 * DAY, end=122 * DAY + 5)
+    downloader.fail = False
+    store.sync("NEW-USD", "1d", 80 * DAY, end=122 * DAY + 5)
+    store.sync("NEW-USD", "1d", 85 * DAY, end=122 * DAY + 5)
+    candles = store.load("NEW-USD", "1d")
+    files = sorted(name for name in os.listdir(directory) if name.endswith(".bin"))
+
+    print(f"requested windows (days): {downloader.windows}")
+    print(f"stored {len(candles)} candles, days {candles['ts'][0] // DAY}..{candles['ts'][-1] // DAY}")
+    expected = [(90, 120), (120, 122), (80, 90), (80, 90)]
+    if downloader.windows != expected:
+        errors.append(f"expected windows {expected}, got {downloader.windows}")
+    if list(candles["ts"] // DAY) != list(range(100, 122)):
+        errors.append(f"stored days {list(candles['ts'] // DAY)}")
+    if not np.array_equal(candles["close"], candles["ts"] / DAY):
+        errors.append("closes don't match their candles")
+    if list(held["ts"] // DAY) != [100, 101, 102]:
+        errors.append(f"a view taken before a write changed to days {list(held['ts'] // DAY)}")
+    if len(files) != 1:
+        errors.append(f"expected only the newest candle file, found {files}")
+    view = store.range("NEW-USD", "1d", 110 * DAY, 115 * DAY)
+    if list(view["ts"] // DAY) != list(range(110, 115)):
+        errors.append(f"range returned days {list(view['ts'] // DAY)}")
+
+    if errors:
+        sys.exit("FAIL: " + "; ".join(errors))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Forecast chart file_id reuse and fallback.
+
+Sends /forecast for a cached forecast whose stored Telegram file_id is rejected, and checks the
+chart is uploaded again, the new file_id is stored and the next /forecast reuses it.
+
+Run from the repository root:  python .test/check_file_id.py
+"""
+
+import asyncio, os, sys, tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.libraries.utils import const
+
+directory = tempfile.mkdtemp()
+const.DATABASE_NAME = os.path.join(directory, "file_id.db")
+const.FORECAST_CACHE_DIR = os.path.join(directory, "forecasts")
+const.SYMBOL_CATALOG_PATH = os.path.join(directory, "symbols.json")
+
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendPhoto
+from aiogram.types import Chat, Message, PhotoSize
+from modules.handlers import database
+from modules.libraries.cache import forecast_cache
+from modules.routers.routers import router
+from fixtures import FakeSession, update
+
+USER_ID = 7
+
+
+class FileIdSession(FakeSession):
+    # Rejects the stale file_id, answers uploads with a fresh one
+
+    def __init__(self):
+        super().__init__()
+        self.photos = []
+
+    def respond(self, method, chat: Chat):
+        if not isinstance(method, SendPhoto):
+            return super().respond(method, chat)
+        photo = method.photo if isinstance(method.photo, str) else "upload"
+        self.photos.append(photo)
+        if photo == "stale-id":
+            raise TelegramBadRequest(method=method, message="Bad Request: wrong file identifier")
+        size = PhotoSize(file_id="fresh-id", file_unique_id="fresh", width=1000, height=500)
+        return Message(message_id=2, date=datetime.now(), chat=chat, photo=[size])
+
+
+async def main():
+    await database.create_tables()
+    await database.add_user(USER_ID, "user")
+    await database.info_updater(USER_ID, "currency", "BTC")
+    forecast_cache.put("BTC-USD", "1d", 60, "123.45", b"\x89PNG chart")
+    forecast_cache.set_file_id("BTC-USD", "1d", 60, "stale-id")
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    session = FileIdSession()
+    bot = Bot(token="42:FILEID", session=session)
+    await dp.feed_update(bot, update(1, USER_ID, "/forecast"))
+    await dp.feed_update(bot, update(2, USER_ID, "/forecast"))
+    stored = forecast_cache.get("BTC-USD", "1d", 60)["file_id"]
+    await database.close()
+
+    print(f"photos sent: {session.photos}, stored file_id: {stored}")
+    if session.photos != ["stale-id", "upload", "fresh-id"] or stored != "fresh-id":
+        sys.exit("FAIL: rejected file_id was not replaced by a fresh upload")
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
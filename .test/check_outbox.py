@@ -0,0 +1,128 @@
+"""
+Alert outbox handoff.
+
+Triggers alerts in one scheduler, loses its send queue as if the worker process died, and checks
+that the next owner replays every committed alert exactly once. Then checks that revoking users
+from a live scheduler leaves their queued alerts to the new owner instead of sending them twice.
+
+Run from the repository root:  python .test/check_outbox.py
+"""
+
+import asyncio, os, sys, tempfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.libraries.utils import const
+
+directory = tempfile.mkdtemp()
+const.DATABASE_NAME = os.path.join(directory, "outbox.db")
+const.SYMBOL_CATALOG_PATH = os.path.join(directory, "symbols.json")
+const.SEND_GLOBAL_RATE = const.SEND_CHAT_RATE = const.SEND_CHAT_BURST = 10 ** 6
+
+from modules.libraries.cache import price_cache
+from modules.libraries.dbms import Database
+from modules.libraries.scheduler import AlertScheduler
+from modules.libraries.sender import send_queue
+
+USERS = 20
+
+
+class FakeBot:
+
+    def __init__(self, hold: bool = False):
+        self.sent = Counter()
+        self._hold = hold  # never finishes a send, like a worker stuck behind the rate limit
+
+    async def send_message(self, chat_id: int, text: str):
+        if self._hold:
+            await asyncio.Event().wait()
+        self.sent[chat_id] += 1
+
+
+async def trigger(scheduler: AlertScheduler, database: Database, user_ids: list, price: int):
+    # Every user is due now and the price is far outside their band
+    await scheduler.resync()
+    for user_id in user_ids:
+        scheduler.schedule(user_id)
+    price_cache.put("BTC", price)
+    await scheduler.tick()
+    await database.flush()
+
+
+async def check_dead_owner(database: Database, user_ids: list) -> list:
+    dead = AlertScheduler(database, FakeBot(hold=True))
+    await trigger(dead, database, user_ids, 200)
+    # The process is gone: nothing in its send queue survives and nothing was acked
+    send_queue.cancel(lambda chat_id: True)
+    for task in list(send_queue._inflight):
+        task.cancel()
+    await send_queue.stop()
+
+    bot = FakeBot()
+    owner = AlertScheduler(database, bot)
+    await owner.resync()
+    await asyncio.sleep(0.2)
+    await database.flush()
+    await owner.replay()
+    await asyncio.sleep(0.2)
+    await database.flush()
+    left = await database.fetch_outbox()
+
+    print(f"dead owner: {sum(bot.sent.values())} alerts replayed to {len(bot.sent)} users, {len(left)} left in the outbox")
+    errors = []
+    if bot.sent != Counter({user_id: 1 for user_id in user_ids}):
+        errors.append(f"expected one replayed alert per user, got {dict(bot.sent)}")
+    if left:
+        errors.append(f"delivered alerts still in the outbox: {left[:5]}")
+    return errors
+
+
+async def check_revoke(database: Database, user_ids: list) -> list:
+    donor_bot = FakeBot()
+    donor = AlertScheduler(database, donor_bot)
+    # Keeps the donor's alerts queued until the revoke
+    send_queue.set_global_rate(1e-9)
+    send_queue._global.take()
+    await trigger(donor, database, user_ids, 100)
+    await donor.revoke(lambda user_id: True)
+    send_queue.set_global_rate(const.SEND_GLOBAL_RATE)
+
+    bot = FakeBot()
+    owner = AlertScheduler(database, bot)
+    await owner.resync()
+    await asyncio.sleep(0.2)
+    await database.flush()
+    left = await database.fetch_outbox()
+
+    print(f"revoke: donor sent {sum(donor_bot.sent.values())}, new owner sent {sum(bot.sent.values())}, {len(left)} left")
+    errors = []
+    if donor_bot.sent:
+        errors.append(f"revoked donor still sent {dict(donor_bot.sent)}")
+    if bot.sent != Counter({user_id: 1 for user_id in user_ids}):
+        errors.append(f"expected one alert per user from the new owner, got {dict(bot.sent)}")
+    if left:
+        errors.append(f"delivered alerts still in the outbox: {left[:5]}")
+    return errors
+
+
+async def main():
+    database = Database(const.DATABASE_NAME)
+    await database.create_tables()
+    user_ids = list(range(1, USERS + 1))
+    for user_id in user_ids:
+        await database.add_user(user_id, f"user{user_id}")
+        database.queue_update(user_id, "threshold", 10)
+        database.queue_update(user_id, "last_rate", 150)
+    await database.flush()
+
+    errors = await check_dead_owner(database, user_ids)
+    errors += await check_revoke(database, user_ids)
+    await send_queue.stop()
+    await database.close()
+    if errors:
+        sys.exit("FAIL: " + "; ".join(errors))
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
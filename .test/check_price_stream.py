@@ -0,0 +1,103 @@
+"""
+Price stream reconnect and resubscribe.
+
+Runs a fake ticker websocket that, like the exchange, fails the connection on a product it
+doesn't list and later drops another one. Checks that the stream stops asking for the rejected
+product, subscribes to currencies added while connected, reconnects, resubscribes to everything
+else it tracks and keeps delivering prices to its listeners.
+
+Run from the repository root:  python .test/check_price_stream.py
+"""
+
+import asyncio, json, logging, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiohttp import web
+from modules.libraries.stream import PriceStream
+from fixtures import serve
+
+
+class FakeFeed:
+
+    def __init__(self):
+        self.connections = []  # product ids subscribed on each connection, in order
+
+    async def handle(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscribed = []
+        self.connections.append(subscribed)
+        number = len(self.connections)
+        async for message in ws:
+            data = json.loads(message.data)
+            subscribed.extend(data["product_ids"])
+            if "USD-USD" in data["product_ids"]:
+                await ws.send_json({"type": "error", "message": "Failed to subscribe", "reason": "USD-USD is not a valid product"})
+                await ws.close()
+            elif number == 2 and len(subscribed) == 2:
+                await ws.send_json({"type": "ticker", "product_id": "BTC-USD", "price": "100.4"})
+            elif number == 2:
+                # The currency added while connected arrived as its own subscription, now drop
+                await ws.close()
+            else:
+                await ws.send_json({"type": "ticker", "product_id": "ETH-USD", "price": "2000"})
+        return ws
+
+
+class Records(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+async def main():
+    records = Records()
+    logging.getLogger().addHandler(records)
+    feed = FakeFeed()
+    app = web.Application()
+    app.router.add_get("/ws", feed.handle)
+    runner, url = await serve(app)
+
+    stream = PriceStream(f"ws{url[4:]}/ws", backoff=0.05, max_backoff=0.1)
+    prices = []
+    second = asyncio.Event()
+
+    def listener(currency: str, price: int):
+        prices.append((currency, price))
+        if currency == "BTC":
+            stream.add("SOL")
+            stream.add("USD")
+        if currency == "ETH":
+            second.set()
+
+    stream.add_listener(listener)
+    stream.track(["btc", "eth", "usd"])
+    await stream.start()
+    errors = []
+    try:
+        await asyncio.wait_for(second.wait(), 10)
+    except asyncio.TimeoutError:
+        errors.append("no price after the reconnect")
+    await stream.stop()
+    await runner.cleanup()
+
+    print(f"subscriptions per connection: {feed.connections}")
+    print(f"prices: {prices}, reconnects {stream.reconnects}")
+    expected = [["BTC-USD", "ETH-USD", "USD-USD"], ["BTC-USD", "ETH-USD", "SOL-USD"], ["BTC-USD", "ETH-USD", "SOL-USD"]]
+    if [sorted(products) for products in feed.connections] != expected:
+        errors.append(f"expected subscriptions {expected}, got {feed.connections}")
+    if prices != [("BTC", 100), ("ETH", 2000)]:
+        errors.append(f"unexpected prices {prices}")
+    if not any("rejected USD" in message for message in records.messages):
+        errors.append("rejected product was not logged")
+    if errors:
+        sys.exit("FAIL: " + "; ".join(errors))
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
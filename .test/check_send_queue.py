@@ -0,0 +1,87 @@
+"""
+SendQueue flood control and alert coalescing.
+
+Checks that a RetryAfter pauses every send for the requested time and retries the failed one,
+and that alerts posted to a chat before it gets a turn collapse into the newest one.
+
+Run from the repository root:  python .test/check_send_queue.py
+"""
+
+import asyncio, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from modules.libraries.sender import SendQueue
+
+RETRY_AFTER = 1
+
+
+async def check_retry_after() -> list:
+    queue = SendQueue(global_rate=100, chat_rate=100, chat_burst=100)
+    started = time.monotonic()
+    sent = []
+    attempts = {"flooded": 0}
+
+    async def flooded():
+        attempts["flooded"] += 1
+        if attempts["flooded"] == 1:
+            raise TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "Too Many Requests", RETRY_AFTER)
+        sent.append(("flooded", time.monotonic() - started))
+        return "flooded"
+
+    async def other():
+        sent.append(("other", time.monotonic() - started))
+        return "other"
+
+    first = queue.submit(1, flooded)
+    await asyncio.sleep(0.1)
+    second = queue.submit(2, other)
+    results = await asyncio.gather(first, second)
+    await queue.stop()
+
+    errors = []
+    if results != ["flooded", "other"]:
+        errors.append(f"unexpected results {results}")
+    if queue.retried != 1 or attempts["flooded"] != 2:
+        errors.append(f"expected one retry, got {queue.retried} ({attempts['flooded']} attempts)")
+    if any(elapsed < RETRY_AFTER * 0.95 for _, elapsed in sent):
+        errors.append(f"sends went out during the pause: {sent}")
+    print(f"retry after: {[(name, round(elapsed, 2)) for name, elapsed in sent]}, retried {queue.retried}")
+    return errors
+
+
+async def check_coalescing() -> list:
+    queue = SendQueue(global_rate=100, chat_rate=100, chat_burst=100)
+    sent = []
+
+    def alert(chat_id: int, number: int):
+        async def send():
+            sent.append((chat_id, number))
+        return send
+
+    # Posted back to back, so the queue has no chance to send any of them in between
+    for number in range(5):
+        queue.post(1, alert(1, number))
+    queue.post(2, alert(2, 0))
+    await asyncio.sleep(0.2)
+    await queue.stop()
+
+    errors = []
+    if sorted(sent) != [(1, 4), (2, 0)]:
+        errors.append(f"expected only the newest alert per chat, sent {sent}")
+    if queue.coalesced != 4:
+        errors.append(f"expected 4 coalesced alerts, got {queue.coalesced}")
+    print(f"coalescing: sent {sent}, coalesced {queue.coalesced}")
+    return errors
+
+
+async def main():
+    errors = await check_retry_after() + await check_coalescing()
+    if errors:
+        sys.exit("FAIL: " + "; ".join(errors))
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
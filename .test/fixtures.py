@@ -0,0 +1,58 @@
+"""
+Stand-ins shared by the scripts in this directory: a Bot API session that never leaves the
+process, a builder for incoming updates and a local aiohttp server.
+
+Scripts run as  python .test/<script>.py  import it with  from fixtures import ...
+"""
+
+import asyncio, random
+from datetime import datetime
+from aiohttp import web
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update, User
+
+
+class FakeSession(BaseSession):
+    # Answers every Bot API call with a message, after a random delay up to `delay` seconds
+    # so handlers interleave; subclasses change the answer in respond()
+
+    def __init__(self, delay: float = 0.0):
+        super().__init__()
+        self._delay = delay
+
+    async def make_request(self, bot, method, timeout=None):
+        if self._delay:
+            await asyncio.sleep(random.uniform(0, self._delay))
+        return self.respond(method, Chat(id=getattr(method, "chat_id", 0), type="private"))
+
+    def respond(self, method, chat: Chat):
+        return Message(message_id=1, date=datetime.now(), chat=chat)
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def update(update_id: int, user_id: int, text: str) -> Update:
+    user = User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=f"user{user_id}")
+    message = Message(
+        message_id=update_id,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=user,
+        text=text,
+        entities=[{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith("/") else None,
+    )
+    return Update(update_id=update_id, message=message)
+
+
+async def serve(app: web.Application) -> tuple:
+    # On a free local port, returns the runner to clean up and the base url
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
@@ -0,0 +1,72 @@
+"""
+Concurrency stress test for per-update user identity.
+
+Feeds thousands of interleaved /set_threshold and /set_interval conversations through the
+real router concurrently and checks that every user's row only holds that user's values.
+
+Run from the repository root:  python .test/stress_context.py [users]
+"""
+
+import asyncio, os, random, sys, tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from modules.libraries.utils import const
+
+const.DATABASE_NAME = os.path.join(tempfile.mkdtemp(), "stress.db")
+# Replies go through the send queue; this tests identity isolation, not Telegram's rate limits
+const.SEND_GLOBAL_RATE = const.SEND_CHAT_RATE = const.SEND_CHAT_BURST = 10 ** 6
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from modules.handlers import database
+from modules.routers.routers import router
+from fixtures import FakeSession, update
+
+USERS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+class YieldingStorage(MemoryStorage):
+    # Behaves like a networked FSM storage: reading the state yields to other updates
+
+    async def get_state(self, key):
+        await asyncio.sleep(random.uniform(0, 0.002))
+        return await super().get_state(key)
+
+
+async def conversation(dp: Dispatcher, bot: Bot, user_id: int):
+    await asyncio.sleep(random.uniform(0, 0.05))
+    await dp.feed_update(bot, update(user_id * 10, user_id, "/set_threshold"))
+    await dp.feed_update(bot, update(user_id * 10 + 1, user_id, str(user_id % 90 + 1)))
+    await dp.feed_update(bot, update(user_id * 10 + 2, user_id, "/set_interval"))
+    await dp.feed_update(bot, update(user_id * 10 + 3, user_id, str(user_id + 1000)))
+
+
+async def main():
+    await database.create_tables()
+    user_ids = list(range(1, USERS + 1))
+    for user_id in user_ids:
+        await database.add_user(user_id, f"user{user_id}")
+
+    dp = Dispatcher(storage=YieldingStorage())
+    dp.include_router(router)
+    bot = Bot(token="42:STRESS", session=FakeSession(delay=0.005))
+
+    # Each conversation runs in its own task, as aiogram does for polled updates
+    await asyncio.gather(*(asyncio.create_task(conversation(dp, bot, user_id)) for user_id in user_ids))
+    await database.flush()
+
+    rows = await database.fetch_many(user_ids)
+    wrong = [
+        row for row in rows
+        if row[3] != row[0] % 90 + 1 or row[2] != row[0] + 1000
+    ]
+    await database.close()
+
+    print(f"{len(rows)} users, {len(wrong)} with values from another user")
+    if wrong or len(rows) != USERS:
+        sys.exit(f"FAIL: cross-user writes detected, e.g. {wrong[:5]}")
+    print("OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,11 +5,22 @@ AUTHOR: github.com/atheop1337 😘
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from modules.libraries.dbms import Database
+from aiogram.fsm.storage.memory import MemoryStorage
+from modules.libraries.cluster import Coordinator
+from modules.libraries.metrics import metrics, MetricsMiddleware, serve_metrics
+from modules.libraries.precompute import ForecastPrecompute
+from modules.libraries.scheduler import AlertScheduler
+from modules.libraries.sender import send_queue
+from modules.libraries.stream import price_stream
+from modules.libraries.workers import forecast_pool
 from modules.routers.routers import router as handlers_router
-from modules.libraries.utils import const
+from modules.handlers import handlers, database
+from modules.libraries.cache import price_cache, forecast_cache, UserCache
+from modules.libraries.catalog import symbol_catalog
+from modules.libraries.utils import const, http_client
+from modules.libraries.webhook import run_webhook
 from datetime import datetime
-import asyncio, logging, os
+import argparse, asyncio, logging, os
 
 TOKEN_FILE_PATH = r"C:\Everything\tokens\currency\TOKEN"
 
@@ -42,24 +53,115 @@ if not TOKEN:
     raise ValueError("No BOT_TOKEN found in the token file. Please check your token.")
 
 
-async def main() -> None:
-    db = Database(const.DATABASE_NAME)
-    await db.create_tables()
-    dp = Dispatcher()
+async def on_startup(bot: Bot, workers: int, alerts: bool, dispatcher: Dispatcher):
+    await database.create_tables()
+    await symbol_catalog.start()
+    price_cache.add_listener(database.record_tick)
+    if not alerts:
+        # Another instance owns alerts, the price stream and the precompute job
+        logging.info("Alerts are disabled in this instance")
+        return
+    if workers:
+        # Alerts are sent by worker processes, this one only serves updates
+        send_queue.set_global_rate(const.SEND_GLOBAL_RATE * const.SEND_MAIN_SHARE)
+        dispatcher["coordinator"] = Coordinator(TOKEN, workers)
+        await dispatcher["coordinator"].start()
+    else:
+        handlers.scheduler = AlertScheduler(database, bot)
+        await handlers.scheduler.start()
+    if price_stream.enabled:
+        price_stream.add_listener(price_cache.put)
+        price_stream.add_listener(database.record_tick)
+        # The only websocket, workers get its prices from the coordinator
+        price_stream.add_listener(dispatcher["coordinator"].on_price if workers else handlers.scheduler.on_price)
+        price_stream.track(currency for currency in await database.fetch_currencies() if symbol_catalog.is_known(currency))
+        await price_stream.start()
+    dispatcher["precompute"] = ForecastPrecompute(database)
+    await dispatcher["precompute"].start()
+
+
+async def on_shutdown(bot: Bot, dispatcher: Dispatcher):
+    if handlers.scheduler is not None:
+        await handlers.scheduler.stop()
+    if "coordinator" in dispatcher.workflow_data:
+        await dispatcher["coordinator"].stop()
+    if "precompute" in dispatcher.workflow_data:
+        await dispatcher["precompute"].stop()
+    await price_stream.stop()
+    await symbol_catalog.stop()
+    await send_queue.stop()
+    await http_client.close()
+    forecast_pool.shutdown()
+    await database.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CurrencySpy telegram bot")
+    parser.add_argument("--webhook", action="store_true", help="serve updates over a webhook instead of long polling")
+    parser.add_argument("--host", default=const.WEBHOOK_HOST)
+    parser.add_argument("--port", type=int, default=const.WEBHOOK_PORT)
+    parser.add_argument("--path", default=const.WEBHOOK_PATH)
+    parser.add_argument("--url", default=const.WEBHOOK_URL, help="public base url to register with telegram")
+    parser.add_argument("--workers", type=int, default=0, help="send alerts from this many worker processes")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics on this port in polling mode")
+    parser.add_argument("--profile", type=float, default=0.0, help="share of updates profiled, slow ones are logged")
+    parser.add_argument("--no-alerts", action="store_true", help="only serve updates, another instance sends alerts")
+    parser.add_argument("--redis", default=const.FSM_REDIS_URL, help="redis url for FSM state shared between instances")
+    args = parser.parse_args()
+    # Several webhook instances behind one url: exactly one sends alerts, all of them share FSM state
+    if args.no_alerts and not args.redis:
+        parser.error("--no-alerts runs next to another instance, it needs --redis to share FSM state")
+    if args.no_alerts and args.workers:
+        parser.error("--no-alerts and --workers can't be combined")
+    return args
+
+
+def create_storage(redis_url):
+    if not redis_url:
+        return MemoryStorage()
+    try:
+        from aiogram.fsm.storage.redis import RedisStorage
+    except ImportError:
+        raise ValueError("--redis needs the redis package, pip install redis")
+    # Any instance may get the next update of a user, so records cached in one process go stale
+    database.users = UserCache(max_size=0)
+    return RedisStorage.from_url(redis_url)
+
+
+async def main(args) -> None:
+    dp = Dispatcher(storage=create_storage(args.redis), workers=args.workers, alerts=not args.no_alerts)
     dp.include_routers(handlers_router)
+    instrumentation = MetricsMiddleware(metrics, profile_rate=args.profile)
+    handlers_router.message.middleware(instrumentation)
+    handlers_router.callback_query.middleware(instrumentation)
+    metrics.gauge("send_queue_depth", lambda: send_queue.depth)
+    metrics.gauge("forecasts_pending", lambda: forecast_pool.pending)
+    metrics.gauge("user_cache_hit_rate", lambda: database.users.stats()["hit_rate"])
+    metrics.gauge("forecast_cache_hits", lambda: forecast_cache.hits)
+    # Same lifecycle for polling and webhook mode
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
+    metrics_runner = None
     try:
-        await dp.start_polling(bot)
+        if args.webhook:
+            await run_webhook(dp, bot, args.host, args.port, args.path, url=args.url, secret=const.WEBHOOK_SECRET)
+        else:
+            if args.metrics_port:
+                metrics_runner = await serve_metrics(metrics, args.host, args.metrics_port)
+            await dp.start_polling(bot)
     finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await bot.session.close()
-        await db.close()
 
 
 if __name__ == "__main__":
     try:
+        args = parse_args()
         setup_logging()
         logging.info(f"Using {'WIN' if os.name == 'nt' else 'UNIX'} base kernel")
-        asyncio.run(main())
+        asyncio.run(main(args))
     except Exception as e:
         logging.exception("An error occurred")
\ No newline at end of file
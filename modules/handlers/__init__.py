@@ -1,8 +1,12 @@
 from modules.handlers.handlers import Handlers
+from modules.libraries.dbms import Database
 from modules.libraries.utils import const
 
+# Shared database, one persistent connection for the whole bot
+database = Database(const.DATABASE_NAME)
+
 # Main handler
-handlers = Handlers(const.DATABASE_NAME)
+handlers = Handlers(database)
 
 # Start handler
 start_handler = handlers.StartHandler(parent=handlers)
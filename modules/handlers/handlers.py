@@ -2,24 +2,47 @@ from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramBadRequest
 from modules.libraries.dbms import Database
-from modules.libraries.utils import const, _States, _Kbs, _Messages, _Methods, CryptoTracker
+from modules.libraries.utils import const, _States, _Kbs, _Messages, _Methods
+from modules.libraries.cache import forecast_cache
+from modules.libraries.catalog import symbol_catalog
+from modules.libraries.metrics import metrics
+from modules.libraries.sender import send_queue
+from modules.libraries.stream import price_stream
+from modules.libraries.workers import forecast_pool, PoolBusy
+from contextvars import ContextVar
 from datetime import datetime
-from typing import Union
-from asyncio import sleep
+from typing import NamedTuple, Union
 import logging
 
+class UserContext(NamedTuple):
+    user_id: Union[int, None]
+    user_name: Union[str, None]
+
+
+# Identity of the update being handled; every update runs in its own task, so this
+# is per update even though the Handlers instance is shared
+_current_user: ContextVar[UserContext] = ContextVar("current_user", default=UserContext(None, None))
+
+
 class Handlers:
 
-    def __init__(self, db: str):
-        self._db = Database(db)
-        self._user_id = None
-        self._user_name = None
+    def __init__(self, db: Database):
+        self._db = db
+        self.scheduler = None
+
+    @property
+    def _user_id(self) -> Union[int, None]:
+        return _current_user.get().user_id
+
+    @property
+    def _user_name(self) -> Union[str, None]:
+        return _current_user.get().user_name
 
     async def get_info(self, type: Union[types.Message, types.CallbackQuery]):
         if isinstance(type, (types.Message, types.CallbackQuery)):
-            self._user_id = type.from_user.id
-            self._user_name = type.from_user.username
+            _current_user.set(UserContext(type.from_user.id, type.from_user.username))
         else:
             raise ValueError("Unsupported type provided")
 
@@ -38,6 +61,14 @@ class Handlers:
             else:
                 logging.warning("Unsupported type provided")
 
+        async def _answer(self, message: types.Message, text: str, **kwargs) -> types.Message:
+            with metrics.timer("send"):
+                return await send_queue.submit(message.chat.id, lambda: message.answer(text, **kwargs))
+
+        async def _answer_photo(self, message: types.Message, photo, **kwargs) -> types.Message:
+            with metrics.timer("send"):
+                return await send_queue.submit(message.chat.id, lambda: message.answer_photo(photo, **kwargs))
+
         async def _handle_message(self, message: types.Message, state: FSMContext, state_name):
             raise NotImplementedError
 
@@ -51,23 +82,27 @@ class Handlers:
             successfully = await self._parent._db.add_user(self._parent._user_id, self._parent._user_name)
             if successfully == 409:
                 await self._parent._db.update_currency_price(self._parent._user_id)
+            elif successfully and self._parent.scheduler is not None:
+                self._parent.scheduler.schedule(self._parent._user_id)
             _message = _Messages.get_welcome_message(self._parent._user_name, successfully)
-            await message.answer(_message)
+            await self._answer(message, _message)
 
         async def _handle_callback_query(self, callback_query: types.CallbackQuery, state: FSMContext, state_name):
             logging.info(f"{self._parent._user_id} started bot from callback")
             successfully = await self._parent._db.add_user(self._parent._user_id)
             if successfully == 409:
                 await self._parent._db.update_currency_price(self._parent._user_id)
+            elif successfully and self._parent.scheduler is not None:
+                self._parent.scheduler.schedule(self._parent._user_id)
             _message = _Messages.get_welcome_message(self._parent._user_name, successfully) 
-            await callback_query.message.answer(_message)
+            await self._answer(callback_query.message, _message)
 
     class SetCurrencyHandler(BaseHandler):
 
         async def _handle_message(self, message: types.Message, state: FSMContext, state_name):
             if state_name is None:
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} started changing currency from message")
-                await message.answer(_Messages.get_set_currency_message())
+                await self._answer(message, _Messages.get_set_currency_message())
                 await state.set_state(_States.SetCurrency.currency)
             elif state_name == _States.SetCurrency.currency:
                 await self._handle_currency(message, state)
@@ -75,21 +110,28 @@ class Handlers:
         async def _handle_callback_query(self, callback_query: types.CallbackQuery, state: FSMContext, state_name):
             if state_name is None:
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} started changing currency from callback")
-                await callback_query.message.answer(_Messages.get_set_currency_message())
+                await self._answer(callback_query.message, _Messages.get_set_currency_message())
                 await state.set_state(_States.SetCurrency.currency)
             elif state_name == _States.SetCurrency.currency:
                 await self._handle_currency(callback_query.message, state)
 
         async def _handle_currency(self, message: types.Message, state: FSMContext):
-            currency = message.text
             try:
+                currency = symbol_catalog.resolve(message.text or "")
+                if currency is None:
+                    # Stays in the same state, so the next message is another try
+                    logging.info(f"{self._parent._user_name} with {self._parent._user_id} asked for unknown currency {message.text}")
+                    await self._answer(message, _Messages.get_unknown_currency_message(message.text or ""))
+                    return
                 successfully = await self._parent._db.info_updater(self._parent._user_id, "currency", currency)
+                if successfully:
+                    price_stream.add(currency)
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} changed currency to {currency}")
-                await message.answer(f"Ваша отслеживаемая валюта успешно изменена на {currency}")
+                await self._answer(message, f"Ваша отслеживаемая валюта успешно изменена на {currency}")
                 await state.clear()
             except Exception as e:
                 logging.error(f"Failed to update currency: {e}")
-                await message.answer(f"Что-то пошло не так во время изменения валюты, попробуйте позже")
+                await self._answer(message, f"Что-то пошло не так во время изменения валюты, попробуйте позже")
                 await state.clear()
                 return
 
@@ -99,7 +141,7 @@ class Handlers:
         async def _handle_message(self, message: types.Message, state: FSMContext, state_name):
             if state_name is None:
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} started changing interval from message")
-                await message.answer(_Messages.get_set_interval_message())
+                await self._answer(message, _Messages.get_set_interval_message())
                 await state.set_state(_States.SetInterval.interval)
             elif state_name == _States.SetInterval.interval:
                 await self._handle_interval(message, state)
@@ -107,7 +149,7 @@ class Handlers:
         async def _handle_callback_query(self, callback_query: types.CallbackQuery, state: FSMContext, state_name):
             if state_name is None:
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} started changing interval from callback")
-                await callback_query.message.answer(_Messages.get_set_interval_message())
+                await self._answer(callback_query.message, _Messages.get_set_interval_message())
                 await state.set_state(_States.SetInterval.interval)
             elif state_name == _States.SetInterval.interval:
                 await self._handle_interval(callback_query.message, state)
@@ -118,10 +160,10 @@ class Handlers:
                 interval = int(interval)
                 successfully = await self._parent._db.info_updater(self._parent._user_id, "interval", interval)
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} changed interval to {interval} seconds")
-                await message.answer(f"Ваш текущий интервал уведомлений успешно изменен на {interval} секунд")
+                await self._answer(message, f"Ваш текущий интервал уведомлений успешно изменен на {interval} секунд")
                 await state.clear()
             except ValueError:
-                await message.answer("Интервал должен быть числом")
+                await self._answer(message, "Интервал должен быть числом")
                 await state.clear()
                 return
             except Exception as e:
@@ -134,7 +176,7 @@ class Handlers:
         async def _handle_message(self, message: types.Message, state: FSMContext, state_name):
             if state_name is None:
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} started changing threshold from message")
-                await message.answer(_Messages.get_set_threshold_message())
+                await self._answer(message, _Messages.get_set_threshold_message())
                 await state.set_state(_States.SetThreshold.threshold)
             elif state_name == _States.SetThreshold.threshold:
                 await self._handle_threshold(message, state)
@@ -142,7 +184,7 @@ class Handlers:
         async def _handle_callback_query(self, callback_query: types.CallbackQuery, state: FSMContext, state_name):
             if state_name is None:
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} started changing threshold from callback")
-                await callback_query.message.answer(_Messages.get_set_threshold_message())
+                await self._answer(callback_query.message, _Messages.get_set_threshold_message())
                 await state.set_state(_States.SetThreshold.threshold)
             elif state_name == _States.SetThreshold.threshold:
                 await self._handle_threshold(callback_query.message, state)
@@ -151,12 +193,16 @@ class Handlers:
             threshold = message.text
             try:
                 threshold = int(threshold)
+                if threshold <= 0:
+                    await self._answer(message, "Порог должен быть больше нуля")
+                    await state.clear()
+                    return
                 successfully = await self._parent._db.info_updater(self._parent._user_id, "threshold", threshold)
                 logging.info(f"{self._parent._user_name} with {self._parent._user_id} changed threshold to {threshold}")
-                await message.answer(f"Ваш текущий порог уведомлений успешно изменен на {threshold}")
+                await self._answer(message, f"Ваш текущий порог уведомлений успешно изменен на {threshold}")
                 await state.clear()
             except ValueError:
-                await message.answer("Порог должен быть числом")
+                await self._answer(message, "Порог должен быть числом")
                 await state.clear()
                 return
             except Exception as e:
@@ -170,53 +216,60 @@ class Handlers:
             logging.info(f"{self._parent._user_name} with {self._parent._user_id} started getting rate from message")
             successfully = await self._parent._db.update_currency_price(self._parent._user_id)
             if not successfully: 
-                await message.answer("Что-то пошло не так во время обновления получения цены, попробуйте позже")
+                await self._answer(message, "Что-то пошло не так во время обновления получения цены, попробуйте позже")
             udata = await self._parent._db.fetch_info(self._parent._user_id)
             if udata is not None:
-                await message.answer(_Messages.get_rate_message(udata))
+                await self._answer(message, _Messages.get_rate_message(udata))
 
         async def _handle_callback_query(self, callback_query: types.CallbackQuery, state: FSMContext, state_name):
             logging.info(f"{self._parent._user_name} with {self._parent._user_id} started getting rate from callback")
             successfully = await self._parent._db.update_currency_price(self._parent._user_id)
             if not successfully:
-                await callback_query.message.answer("Что-то пошло не так во время обновления получения цены, попробуйте позже")
+                await self._answer(callback_query.message, "Что-то пошло не так во время обновления получения цены, попробуйте позже")
             udata = await self._parent._db.fetch_info(self._parent._user_id)
             if udata is not None:
-                await callback_query.message.answer(_Messages.get_rate_message(udata))
+                await self._answer(callback_query.message, _Messages.get_rate_message(udata))
 
     
     class GetForeCast(BaseHandler):
 
         async def _handle_message(self, message: types.Message, state: FSMContext, state_name):
             logging.info(f"{self._parent._user_name} with {self._parent._user_id} started getting forecast from message")
-            udata = await self._parent._db.fetch_info(self._parent._user_id)
-            currency = udata["currency"]
-            tracker = CryptoTracker(symbol=f"{currency}-USD")
-            forecasted_price = tracker.run_analysis()
-            await sleep(2)
-            try:
-                await message.answer_photo(types.FSInputFile(f'{currency}-USD-FORECAST-PRICE.png'), caption=f"Прогназируемая цена для {currency}: {forecasted_price} USD")
-                logging.info(f"Sent forecasted graph and price for {currency} to user {self._parent._user_id}")
-            except Exception as e:
-                logging.error(f"Failed to send forecasted graph: {e}")
-                await message.answer("Что-то пошло не так во время отправки прогноза, попробуйте позже")
+            await self._send_forecast(message)
 
         async def _handle_callback_query(self, callback_query: types.CallbackQuery, state: FSMContext, state_name):
             logging.info(f"{self._parent._user_name} with {self._parent._user_id} started getting forecast from callback")
+            await self._send_forecast(callback_query.message)
+
+        async def _send_forecast(self, message: types.Message):
             udata = await self._parent._db.fetch_info(self._parent._user_id)
             currency = udata["currency"]
-            tracker = CryptoTracker(symbol=f"{currency}-USD")
-            forecasted_price = tracker.run_analysis()
-            await sleep(2)
+            if not symbol_catalog.is_known(currency):
+                await self._answer(message, _Messages.get_unknown_currency_message(currency))
+                return
+            try:
+                forecast = await forecast_pool.run(f"{currency}-USD")
+            except PoolBusy as e:
+                logging.warning(f"Rejected forecast for user {self._parent._user_id}: {e}")
+                await self._answer(message, _Messages.get_forecast_busy_message())
+                return
+            except Exception as e:
+                logging.error(f"Failed to build forecast for {currency}: {e}")
+                await self._answer(message, "Что-то пошло не так во время построения прогноза, попробуйте позже")
+                return
+            caption = f"Прогнозируемая цена для {currency}: {forecast['price']} USD"
             try:
-                await callback_query.message.answer_photo(photo, caption=f"Прогнозируемая цена для {currency}: {forecasted_price} USD")
+                if forecast.get("file_id") is not None:
+                    try:
+                        await self._answer_photo(message, forecast["file_id"], caption=caption)
+                        logging.info(f"Sent cached forecasted graph and price for {currency} to user {self._parent._user_id}")
+                        return
+                    except TelegramBadRequest as e:
+                        logging.warning(f"Cached file_id for {currency} rejected, uploading again: {e}")
+                photo = types.BufferedInputFile(forecast["chart"], filename=f"{currency}-USD-FORECAST-PRICE.png")
+                sent = await self._answer_photo(message, photo, caption=caption)
+                forecast_cache.set_file_id(forecast["symbol"], forecast["interval"], forecast["days_back"], sent.photo[-1].file_id)
                 logging.info(f"Sent forecasted graph and price for {currency} to user {self._parent._user_id}")
             except Exception as e:
                 logging.error(f"Failed to send forecasted graph: {e}")
-                await message.answer("Что-то пошло не так во время отправки прогноза закрытия, попробуйте позже")
-            
-
-
-
-
-
+                await self._answer(message, "Что-то пошло не так во время отправки прогноза, попробуйте позже")
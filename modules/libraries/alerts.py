@@ -0,0 +1,92 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from typing import Union
+
+INF = float("inf")
+
+
+class AlertEngine:
+
+    def __init__(self):
+        # Per currency, subscribers sorted by the price that triggers them:
+        # upper band (last_rate + threshold%) and lower band (last_rate - threshold%)
+        self._uppers = defaultdict(list)
+        self._lowers = defaultdict(list)
+        self._bands = {}  # user_id -> (currency, lower, upper)
+
+    def __len__(self) -> int:
+        return len(self._bands)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._bands
+
+    @staticmethod
+    def _band(currency: str, threshold: int, last_rate: Union[int, None]) -> Union[tuple, None]:
+        # Without a baseline or a positive threshold there is no band, the latter would match every price
+        if not last_rate or threshold is None or threshold <= 0:
+            return None
+        delta = last_rate * threshold / 100
+        return currency, last_rate - delta, last_rate + delta
+
+    def upsert(self, user_id: int, currency: str, threshold: int, last_rate: Union[int, None]):
+        band = self._band(currency, threshold, last_rate)
+        if self._bands.get(user_id) == band:
+            return
+        self._insert(user_id, band)
+
+    def upsert_many(self, entries: list):
+        # (user_id, currency, threshold, last_rate); a large batch rebuilds the touched lists in
+        # one sort instead of paying a list shift per user
+        changed = []
+        for user_id, currency, threshold, last_rate in entries:
+            band = self._band(currency, threshold, last_rate)
+            if self._bands.get(user_id) != band:
+                changed.append((user_id, band))
+        if len(changed) < max(len(self._bands) // 64, 32):
+            for user_id, band in changed:
+                self._insert(user_id, band)
+            return
+
+        touched = set()
+        for user_id, band in changed:
+            previous = self._bands.pop(user_id, None)
+            if previous is not None:
+                touched.add(previous[0])
+            if band is not None:
+                self._bands[user_id] = band
+                touched.add(band[0])
+        for currency in touched:
+            members = [(user_id, band) for user_id, band in self._bands.items() if band[0] == currency]
+            self._uppers[currency] = sorted((band[2], user_id) for user_id, band in members)
+            self._lowers[currency] = sorted((band[1], user_id) for user_id, band in members)
+
+    def _insert(self, user_id: int, band: Union[tuple, None]):
+        self.remove(user_id)
+        if band is None:
+            return
+        currency, lower, upper = band
+        insort(self._uppers[currency], (upper, user_id))
+        insort(self._lowers[currency], (lower, user_id))
+        self._bands[user_id] = band
+
+    def remove(self, user_id: int):
+        band = self._bands.pop(user_id, None)
+        if band is None:
+            return
+        currency, lower, upper = band
+        for entries, entry in ((self._uppers[currency], (upper, user_id)), (self._lowers[currency], (lower, user_id))):
+            index = bisect_left(entries, entry)
+            if index < len(entries) and entries[index] == entry:
+                del entries[index]
+
+    def triggered(self, user_id: int, price: float) -> bool:
+        band = self._bands.get(user_id)
+        return band is not None and (price >= band[2] or price <= band[1])
+
+    def crossed(self, currency: str, price: float) -> list:
+        # Everyone whose upper band is at or below the price, or lower band at or above it
+        uppers = self._uppers.get(currency, ())
+        lowers = self._lowers.get(currency, ())
+        risen = uppers[:bisect_right(uppers, (price, INF))]
+        fallen = lowers[bisect_left(lowers, (price, -INF)):]
+        return [user_id for _, user_id in risen] + [user_id for _, user_id in fallen]
@@ -0,0 +1,380 @@
+import asyncio, hashlib, json, logging, os, time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Union
+from modules.libraries.catalog import symbol_catalog
+from modules.libraries.metrics import metrics
+from modules.libraries.utils import const, _Methods
+
+
+class PriceCache:
+
+    def __init__(
+        self,
+        fetcher: Callable[[str], Awaitable[Union[int, None]]],
+        bulk_fetcher: Union[Callable[[], Awaitable[Dict[str, int]]], None] = None,
+        ttl: float = const.PRICE_CACHE_TTL,
+        stale_ttl: float = const.PRICE_CACHE_STALE_TTL,
+        max_size: int = const.PRICE_CACHE_SIZE,
+    ):
+        self._fetcher = fetcher
+        self._bulk_fetcher = bulk_fetcher  # every rate in one request, per-symbol fetches are the fallback
+        self._bulk_task = None
+        self._tracked = set()
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._max_size = max_size
+        self._entries = OrderedDict()  # symbol -> (price, fetched_at), LRU order
+        self._inflight = {}
+        self._listeners = []
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bulk_fetches = 0
+        self.fallbacks = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bulk_fetches": self.bulk_fetches,
+            "fallbacks": self.fallbacks,
+        }
+
+    async def get(self, symbol: str) -> Union[int, None]:
+        symbol = symbol.upper()
+        entry = self._entries.get(symbol)
+        if entry is not None:
+            price, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self._ttl:
+                self.hits += 1
+                self._entries.move_to_end(symbol)
+                return price
+            if age < self._ttl + self._stale_ttl:
+                self.stale_hits += 1
+                self._entries.move_to_end(symbol)
+                self._refresh(symbol)
+                return price
+
+        if symbol in self._inflight:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        return await asyncio.shield(self._refresh(symbol))
+
+    async def get_many(self, symbols: Iterable[str]) -> Dict[str, Union[int, None]]:
+        # Misses share one bulk request, so this costs a single round trip however many symbols
+        symbols = sorted({symbol.upper() for symbol in symbols})
+        prices = await asyncio.gather(*(self.get(symbol) for symbol in symbols))
+        return dict(zip(symbols, prices))
+
+    def track(self, symbols: Iterable[str]):
+        # Symbols every bulk fetch refreshes, even when nobody asked for them yet
+        self._tracked = {symbol.upper() for symbol in symbols}
+
+    def put(self, symbol: str, price: int):
+        symbol = symbol.upper()
+        self._entries[symbol] = (price, time.monotonic())
+        self._entries.move_to_end(symbol)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, symbol: str):
+        self._entries.pop(symbol.upper(), None)
+
+    def add_listener(self, listener: Callable[[str, int], None]):
+        # Called with every freshly fetched price, e.g. to record price history
+        self._listeners.append(listener)
+
+    def _refresh(self, symbol: str) -> asyncio.Task:
+        task = self._inflight.get(symbol)
+        if task is None:
+            task = asyncio.create_task(self._fetch(symbol))
+            self._inflight[symbol] = task
+        return task
+
+    async def _fetch(self, symbol: str) -> Union[int, None]:
+        try:
+            if not symbol_catalog.is_known(symbol):
+                # Junk saved before symbols were validated, not worth a round trip
+                return None
+            price = None
+            if self._bulk_fetcher is not None:
+                price = (await asyncio.shield(self._bulk())).get(symbol)
+            if price is None:
+                if self._bulk_fetcher is not None:
+                    self.fallbacks += 1
+                with metrics.timer("http"):
+                    price = await self._fetcher(symbol)
+                if price is not None:
+                    self._store(symbol, price)
+            return price
+        except Exception as e:
+            logging.error(f"Failed to refresh price for {symbol}: {e}")
+            return None
+        finally:
+            self._inflight.pop(symbol, None)
+
+    def _bulk(self) -> asyncio.Task:
+        if self._bulk_task is None or self._bulk_task.done():
+            self._bulk_task = asyncio.create_task(self._fetch_all())
+        return self._bulk_task
+
+    async def _fetch_all(self) -> Dict[str, int]:
+        try:
+            with metrics.timer("http"):
+                rates = await self._bulk_fetcher()
+        except Exception as e:
+            logging.error(f"Failed to fetch exchange rates: {e}")
+            return {}
+        self.bulk_fetches += 1
+        # Only symbols we care about are kept, the response lists hundreds of them
+        for symbol in self._tracked | set(self._entries) | set(self._inflight):
+            price = rates.get(symbol)
+            if price is not None:
+                self._store(symbol, price)
+        return rates
+
+    def _store(self, symbol: str, price: int):
+        self.put(symbol, price)
+        for listener in self._listeners:
+            listener(symbol, price)
+
+
+price_cache = PriceCache(
+    _Methods.get_currency_price,
+    _Methods.get_exchange_rates if const.PRICE_BULK_FETCH else None,
+)
+
+
+class UserRecord:
+
+    __slots__ = ("user_id", "user_name", "currency", "interval", "threshold", "last_rate")
+
+    def __init__(self, user_id: int, user_name: str, currency: str, interval: int, threshold: int, last_rate: Union[int, None]):
+        self.user_id = user_id
+        self.user_name = user_name
+        self.currency = currency
+        self.interval = interval
+        self.threshold = threshold
+        self.last_rate = last_rate
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class UserCache:
+
+    def __init__(self, max_size: int = const.USER_CACHE_SIZE):
+        self._max_size = max_size
+        self._records = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._records),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def get(self, user_id: int) -> Union[UserRecord, None]:
+        record = self._records.get(user_id)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._records.move_to_end(user_id)
+        return record
+
+    def put(self, record: UserRecord):
+        self._records[record.user_id] = record
+        self._records.move_to_end(record.user_id)
+        while len(self._records) > self._max_size:
+            self._records.popitem(last=False)
+
+    def update(self, user_id: int, identity: str, value: any):
+        # Write-through for users already cached, others are loaded on their next read
+        record = self._records.get(user_id)
+        if record is not None:
+            setattr(record, identity, value)
+
+    def invalidate(self, user_id: int):
+        self._records.pop(user_id, None)
+
+
+class ForecastCache:
+
+    INTERVAL_SECONDS = {"m": 60, "h": 3600, "d": 86400}
+
+    def __init__(
+        self,
+        path: str = const.FORECAST_CACHE_DIR,
+        max_age: float = const.FORECAST_CACHE_MAX_AGE,
+        max_bytes: int = const.FORECAST_CACHE_MAX_BYTES,
+    ):
+        self._path = path
+        self._max_age = max_age
+        self._max_bytes = max_bytes
+        self._entries = None  # digest -> meta, loaded from disk on first use
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def step(cls, interval: str) -> int:
+        unit = interval[-1] if interval[-1] in cls.INTERVAL_SECONDS else "d"
+        try:
+            return int(interval[:-1] or 1) * cls.INTERVAL_SECONDS[unit]
+        except ValueError:
+            return cls.INTERVAL_SECONDS["d"]
+
+    @classmethod
+    def candle(cls, interval: str, now: float = None) -> int:
+        # Start of the current (still open) candle; forecasts only change when it rolls over
+        now = time.time() if now is None else now
+        step = cls.step(interval)
+        return int(now // step * step)
+
+    @staticmethod
+    def _digest(symbol: str, interval: str, days_back: int, candle: int) -> str:
+        return hashlib.sha1(f"{symbol}|{interval}|{days_back}|{candle}".encode()).hexdigest()
+
+    def _file(self, digest: str, ext: str) -> str:
+        return os.path.join(self._path, f"{digest}.{ext}")
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            self._entries = {}
+            os.makedirs(self._path, exist_ok=True)
+            for name in os.listdir(self._path):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self._path, name), "r") as file:
+                        meta = json.load(file)
+                    self._entries[name[:-5]] = meta
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Skipping broken forecast cache entry {name}: {e}")
+        return self._entries
+
+    def _entry(self, digest: str) -> Union[dict, None]:
+        # Entries written by another process (the precompute CLI, other instances) since the
+        # index was loaded are picked up from disk
+        entries = self._load()
+        meta = entries.get(digest)
+        if meta is None:
+            try:
+                with open(self._file(digest, "json"), "r") as file:
+                    meta = entries[digest] = json.load(file)
+            except (OSError, ValueError):
+                return None
+        return meta
+
+    def has(self, symbol: str, interval: str, days_back: int) -> bool:
+        # Cheap check without reading the chart or counting a hit/miss
+        meta = self._entry(self._digest(symbol, interval, days_back, self.candle(interval)))
+        return meta is not None and time.time() - meta["created"] <= self._max_age
+
+    def fresh(self, interval: str, last_candle: Union[int, None]) -> bool:
+        # False while the data source hasn't published the last closed candle yet
+        return last_candle is None or last_candle >= self.candle(interval) - self.step(interval)
+
+    def get(self, symbol: str, interval: str, days_back: int) -> Union[dict, None]:
+        digest = self._digest(symbol, interval, days_back, self.candle(interval))
+        meta = self._entry(digest)
+        if meta is None or time.time() - meta["created"] > self._max_age:
+            self.misses += 1
+            return None
+        try:
+            with open(self._file(digest, "png"), "rb") as file:
+                chart = file.read()
+        except OSError:
+            self._remove(digest)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {**meta, "chart": chart}
+
+    def put(self, symbol: str, interval: str, days_back: int, price: str, chart: bytes, last_candle: int = None) -> dict:
+        entries = self._load()
+        candle = self.candle(interval)
+        digest = self._digest(symbol, interval, days_back, candle)
+        meta = {
+            "symbol": symbol,
+            "interval": interval,
+            "days_back": days_back,
+            "price": price,
+            "size": len(chart),
+            "created": time.time(),
+            "last_candle": last_candle,
+            "file_id": None,
+        }
+        if not self.fresh(interval, last_candle):
+            # Caching this would pin a forecast built on old data until the next candle rolls over
+            logging.info(f"Not caching forecast for {symbol}, its last candle {last_candle} is behind")
+            return {**meta, "chart": chart}
+        try:
+            with open(self._file(digest, "png"), "wb") as file:
+                file.write(chart)
+            self._write_meta(digest, meta)
+        except OSError as e:
+            logging.error(f"Failed to store forecast for {symbol}: {e}")
+            return {**meta, "chart": chart}
+        entries[digest] = meta
+        self._evict()
+        return {**meta, "chart": chart}
+
+    def set_file_id(self, symbol: str, interval: str, days_back: int, file_id: Union[str, None]):
+        # Telegram file_id of the uploaded chart, reused instead of uploading it again
+        digest = self._digest(symbol, interval, days_back, self.candle(interval))
+        meta = self._entry(digest)
+        if meta is None or meta.get("file_id") == file_id:
+            return
+        meta["file_id"] = file_id
+        try:
+            self._write_meta(digest, meta)
+        except OSError as e:
+            logging.error(f"Failed to store file_id for {symbol}: {e}")
+
+    def _write_meta(self, digest: str, meta: dict):
+        # Atomic, other processes read entries they didn't write
+        path = self._file(digest, "json")
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(meta, file)
+        os.replace(temporary, path)
+
+    def _remove(self, digest: str):
+        self._entries.pop(digest, None)
+        for ext in ("png", "json"):
+            try:
+                os.remove(self._file(digest, ext))
+            except OSError:
+                pass
+
+    def _evict(self):
+        now = time.time()
+        for digest, meta in list(self._entries.items()):
+            if now - meta["created"] > self._max_age:
+                self._remove(digest)
+        total = sum(meta["size"] for meta in self._entries.values())
+        for digest, meta in sorted(self._entries.items(), key=lambda item: item[1]["created"]):
+            if total <= self._max_bytes:
+                break
+            total -= meta["size"]
+            self._remove(digest)
+
+
+forecast_cache = ForecastCache()
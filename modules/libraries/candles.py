@@ -0,0 +1,166 @@
+import datetime, glob, logging, os, re, time
+from typing import Callable, Tuple
+import numpy as np
+from modules.libraries.utils import const
+
+CANDLE = np.dtype([("ts", "<i8"), ("close", "<f8")])
+
+INTERVAL_SECONDS = {
+    "1m": 60, "2m": 120, "5m": 300, "15m": 900, "30m": 1800, "60m": 3600, "90m": 5400,
+    "1h": 3600, "1d": 86400, "5d": 5 * 86400, "1wk": 7 * 86400, "1mo": 30 * 86400, "3mo": 90 * 86400,
+}
+
+
+def yahoo_downloader(symbol: str, start: int, end: int, interval: str) -> Tuple[np.ndarray, np.ndarray]:
+    import yfinance as yf
+    start = datetime.datetime.fromtimestamp(start, tz=datetime.timezone.utc)
+    end = datetime.datetime.fromtimestamp(end, tz=datetime.timezone.utc)
+    data = yf.download(symbol, start=start, end=end, interval=interval, progress=False)
+    if data is None or data.empty:
+        # yfinance returns an empty frame on failures too, they are only recorded on the side
+        error = getattr(getattr(yf, "shared", None), "_ERRORS", {}).get(symbol)
+        if error:
+            raise RuntimeError(f"download of {symbol} failed: {error}")
+        return np.empty(0, dtype="<i8"), np.empty(0, dtype="<f8")
+    close = data["Close"]
+    if close.ndim > 1:
+        close = close.iloc[:, 0]
+    ts = data.index.asi8 // 10 ** 9
+    return ts.astype("<i8"), close.to_numpy(dtype="<f8")
+
+
+class CandleStore:
+
+    def __init__(self, path: str = const.CANDLE_STORE_DIR, downloader: Callable = yahoo_downloader):
+        self._path = path
+        self._downloader = downloader
+        self._maps = {}  # base file name -> (generation file, memmap)
+        self.downloads = 0
+
+    def _file(self, symbol: str, interval: str) -> str:
+        # Base name, the candles live in <base>.<generation>.bin next to it
+        return os.path.join(self._path, re.sub(r"[^A-Za-z0-9_.-]", "_", f"{symbol}_{interval}"))
+
+    def _generations(self, base: str) -> list:
+        # (generation, file) oldest first; files are never rewritten, so a mapped one stays valid
+        found = [(0, f"{base}.bin")] if os.path.exists(f"{base}.bin") else []
+        for path in glob.glob(f"{base}.*.bin"):
+            try:
+                found.append((int(path[len(base) + 1:-4]), path))
+            except ValueError:
+                continue
+        return sorted(found)
+
+    def load(self, symbol: str, interval: str) -> np.ndarray:
+        # Read-only memory map of every stored candle, sorted by ts
+        base = self._file(symbol, interval)
+        generations = self._generations(base)
+        if not generations:
+            return np.empty(0, dtype=CANDLE)
+        path = generations[-1][1]
+        cached = self._maps.get(base)
+        if cached is None or cached[0] != path:
+            candles = np.memmap(path, dtype=CANDLE, mode="r") if os.path.getsize(path) else np.empty(0, dtype=CANDLE)
+            cached = self._maps[base] = (path, candles)
+        return cached[1]
+
+    def _write(self, symbol: str, interval: str, candles: np.ndarray):
+        # A new generation instead of replacing the file: Windows refuses to replace or delete a
+        # file while any process still has it mapped
+        os.makedirs(self._path, exist_ok=True)
+        base = self._file(symbol, interval)
+        previous = self._generations(base)
+        generation = max(time.time_ns(), previous[-1][0] + 1 if previous else 0)
+        temporary = f"{base}.{os.getpid()}.tmp"
+        candles.tofile(temporary)
+        os.replace(temporary, f"{base}.{generation}.bin")
+        self._maps.pop(base, None)
+        for _, path in previous:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # still mapped somewhere, removed after a later write
+
+    def _covered(self, symbol: str, interval: str, stored: np.ndarray) -> int:
+        # Earliest ts already downloaded, older than the first candle for recently listed symbols
+        first = int(stored["ts"][0])
+        try:
+            with open(f"{self._file(symbol, interval)}.start", "r") as file:
+                return min(int(file.read()), first)
+        except (OSError, ValueError):
+            return first
+
+    def _cover(self, symbol: str, interval: str, start: int):
+        path = f"{self._file(symbol, interval)}.start"
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w") as file:
+                file.write(str(start))
+            os.replace(temporary, path)
+        except OSError as e:
+            logging.error(f"Failed to store covered range for {symbol}: {e}")
+
+    def sync(self, symbol: str, interval: str, start: int, end: int = None):
+        # Downloads only what is missing around the stored range, closed candles only
+        step = INTERVAL_SECONDS.get(interval, 86400)
+        end = int(time.time()) if end is None else end
+        closed = end // step * step
+        stored = self.load(symbol, interval)
+
+        windows = []  # (start, end, is the window before the stored range)
+        if not len(stored):
+            windows.append((start, closed, True))
+        else:
+            covered = self._covered(symbol, interval, stored)
+            if start < covered - step:
+                windows.append((start, covered, True))
+            if stored["ts"][-1] + step < closed:
+                windows.append((int(stored["ts"][-1]) + step, closed, False))
+        if not windows:
+            return
+
+        count, parts = len(stored), [np.array(stored)]
+        del stored  # the copy is enough, the mapping can go before the next generation is written
+        for window_start, window_end, prefix in windows:
+            try:
+                ts, close = self._downloader(symbol, window_start, window_end, interval)
+            except Exception as e:
+                # Asked for again on the next sync
+                logging.error(f"Failed to download {interval} candles for {symbol}: {e}")
+                continue
+            self.downloads += 1
+            fresh = np.empty(len(ts), dtype=CANDLE)
+            fresh["ts"], fresh["close"] = ts, close
+            parts.append(fresh[(fresh["ts"] + step <= end) & ~np.isnan(fresh["close"])])
+            if prefix:
+                # Nothing before the listing date shows up later, don't ask for that window again
+                self._cover(symbol, interval, window_start)
+
+        merged = np.concatenate(parts)
+        if not len(merged):
+            return
+        merged = merged[np.argsort(merged["ts"], kind="stable")]
+        merged = merged[np.concatenate(([True], np.diff(merged["ts"]) > 0))]
+        if len(merged) == count:
+            return
+        try:
+            self._write(symbol, interval, merged)
+            logging.info(f"Stored {len(merged) - count} new {interval} candles for {symbol}")
+        except OSError as e:
+            logging.error(f"Failed to store candles for {symbol}: {e}")
+
+    def range(self, symbol: str, interval: str, start: int, end: int = None) -> np.ndarray:
+        # Zero-copy view of the candles with start <= ts < end
+        candles = self.load(symbol, interval)
+        ts = candles["ts"]
+        left = np.searchsorted(ts, start, side="left")
+        right = len(ts) if end is None else np.searchsorted(ts, end, side="left")
+        return candles[left:right]
+
+    def history(self, symbol: str, interval: str, days_back: int) -> np.ndarray:
+        start = int(time.time()) - days_back * 86400
+        self.sync(symbol, interval, start)
+        return self.range(symbol, interval, start)
+
+
+candle_store = CandleStore()
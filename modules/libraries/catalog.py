@@ -0,0 +1,116 @@
+import asyncio, json, logging, os, re, time
+from typing import Dict, Union
+from modules.libraries.utils import const, http_client
+
+
+def _key(text: str) -> str:
+    # "Bitcoin Cash", "bitcoin-cash" and "BITCOINCASH" are the same lookup
+    return re.sub(r"[\s_\-]+", "", text).casefold()
+
+
+class SymbolCatalog:
+
+    def __init__(
+        self,
+        path: str = const.SYMBOL_CATALOG_PATH,
+        refresh: float = const.SYMBOL_CATALOG_REFRESH,
+    ):
+        self._path = path
+        self._refresh = refresh
+        self._symbols = None  # code -> name, loaded from disk on first use
+        self._index = {}  # lookup key of a code or a name -> code
+        self._updated = 0
+        self._task = None
+
+    def _load(self) -> dict:
+        if self._symbols is None:
+            self._symbols = {}
+            try:
+                with open(self._path, "r") as file:
+                    stored = json.load(file)
+                self._set(stored["symbols"], stored["updated"])
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning(f"Ignoring broken symbol catalog {self._path}: {e}")
+        return self._symbols
+
+    def _set(self, symbols: Dict[str, str], updated: float):
+        index = {}
+        for code, name in symbols.items():
+            if name:
+                index.setdefault(_key(name), code)
+        # Codes win over names that happen to look like another code
+        for code in symbols:
+            index[_key(code)] = code
+        self._symbols, self._index, self._updated = symbols, index, updated
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def resolve(self, text: str) -> Union[str, None]:
+        # Code for what the user typed, None if it is not a supported currency
+        symbols = self._load()
+        key = _key(re.sub(r"-usd$", "", text.strip(), flags=re.IGNORECASE))
+        if not symbols:
+            # Nothing to validate against yet, better to accept than to lock users out
+            return key.upper() or None
+        return self._index.get(key)
+
+    def is_known(self, code: str) -> bool:
+        symbols = self._load()
+        return not symbols or code.upper() in symbols
+
+    async def refresh(self) -> bool:
+        symbols = {}
+        status, data = await http_client.get_json(f"{const.COINBASE_API_URL}/v2/currencies/crypto")
+        if status == 200:
+            for currency in (data or {}).get("data", []):
+                symbols[currency["code"].upper()] = currency.get("name")
+        status, data = await http_client.get_json(f"{const.COINBASE_API_URL}/v2/currencies")
+        if status == 200:
+            for currency in (data or {}).get("data", []):
+                symbols.setdefault(currency["id"].upper(), currency.get("name"))
+        if not symbols:
+            logging.error(f"Failed to refresh symbol catalog: {status}")
+            return False
+
+        self._set(symbols, time.time())
+        try:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            temporary = f"{self._path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as file:
+                json.dump({"updated": self._updated, "symbols": symbols}, file)
+            os.replace(temporary, self._path)
+        except OSError as e:
+            logging.error(f"Failed to store symbol catalog: {e}")
+        logging.info(f"Symbol catalog refreshed with {len(symbols)} currencies")
+        return True
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        self._load()
+        while True:
+            # A fresh catalog from disk is used as is, the first refresh waits until it ages out
+            await asyncio.sleep(max(self._updated + self._refresh - time.time(), 0))
+            try:
+                refreshed = await self.refresh()
+            except Exception as e:
+                logging.error(f"Failed to refresh symbol catalog: {e}")
+                refreshed = False
+            if not refreshed:
+                await asyncio.sleep(const.SYMBOL_CATALOG_RETRY)
+
+
+symbol_catalog = SymbolCatalog()
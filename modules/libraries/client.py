@@ -0,0 +1,70 @@
+import asyncio, logging, random
+from typing import Any, Tuple, Union
+import aiohttp
+
+
+class HttpClient:
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        keepalive_timeout: float = 30,
+        timeout: float = 10,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._retries = retries
+        self._backoff = backoff
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily so the session binds to the running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self._limit,
+                limit_per_host=self._limit_per_host,
+                keepalive_timeout=self._keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self._timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _delay(self, attempt: int, retry_after: Union[str, None] = None) -> float:
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter exponential backoff
+        return random.uniform(0, self._backoff * 2 ** attempt)
+
+    async def get_json(self, url: str, **kwargs) -> Tuple[int, Any]:
+        for attempt in range(self._retries + 1):
+            try:
+                async with self.session.get(url, **kwargs) as response:
+                    if response.status in self.RETRY_STATUSES and attempt < self._retries:
+                        delay = self._delay(attempt, response.headers.get("Retry-After"))
+                        logging.warning(f"GET {url} returned {response.status}, retrying in {delay:.2f}s")
+                        await asyncio.sleep(delay)
+                        continue
+                    if response.status != 200:
+                        return response.status, None
+                    return response.status, await response.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self._retries:
+                    raise
+                delay = self._delay(attempt)
+                logging.warning(f"GET {url} failed with {e!r}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
@@ -0,0 +1,217 @@
+import asyncio, logging, multiprocessing, threading
+from typing import Union
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from modules.libraries.utils import const
+
+
+def partition(user_id: int, partitions: int = const.CLUSTER_PARTITIONS) -> int:
+    return user_id % partitions
+
+
+def run_worker(index: int, token: str, workers: int, conn):
+    # Entry point of a worker process: owns the alerts of whatever partitions it is assigned
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"[%(asctime)s]:%(levelname)s:worker-{index}:%(funcName)s:%(message)s",
+        datefmt="%Y-%m-%d|%H:%M:%S",
+    )
+    asyncio.run(_worker(index, token, workers, conn))
+
+
+async def _worker(index: int, token: str, workers: int, conn):
+    from modules.libraries.cache import price_cache
+    from modules.libraries.dbms import Database
+    from modules.libraries.scheduler import AlertScheduler
+    from modules.libraries.sender import send_queue
+    from modules.libraries.utils import http_client
+
+    loop = asyncio.get_running_loop()
+    inbox = asyncio.Queue()
+
+    def reader():
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                message = ("stop", [])
+            loop.call_soon_threadsafe(inbox.put_nowait, message)
+            if message[0] == "stop":
+                return
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    owned = set()
+    database = Database(const.DATABASE_NAME)
+    price_cache.add_listener(database.record_tick)
+    bot = Bot(token=token, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Workers split Telegram's global budget, minus the share the main process keeps for replies
+    send_queue.set_global_rate(const.SEND_GLOBAL_RATE * (1 - const.SEND_MAIN_SHARE) / workers)
+    scheduler = AlertScheduler(
+        database,
+        bot,
+        owns=lambda user_id: partition(user_id) in owned,
+        partitions=lambda: owned,
+    )
+    await scheduler.start()
+
+    try:
+        while True:
+            kind, partitions = await inbox.get()
+            if kind == "prices":
+                # Streamed by the main process, partitions holds (currency, price) pairs here
+                for currency, price in partitions:
+                    price_cache.put(currency, price)
+                    scheduler.on_price(currency, price)
+                continue
+            if kind == "assign":
+                owned.update(partitions)
+                await scheduler.resync()
+            elif kind == "revoke":
+                revoked = set(partitions)
+                await scheduler.revoke(lambda user_id: partition(user_id) in revoked)
+                owned.difference_update(revoked)
+            elif kind == "stop":
+                break
+            logging.info(f"{kind} {len(partitions)} partitions, owning {len(owned)}")
+            conn.send(("ack", kind))
+    finally:
+        await scheduler.stop()
+        await send_queue.stop()
+        await bot.session.close()
+        await http_client.close()
+        await database.close()
+
+
+class _Worker:
+
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.partitions = set()
+
+
+class Coordinator:
+
+    def __init__(self, token: str, workers: int, partitions: int = const.CLUSTER_PARTITIONS):
+        self._token = token
+        self._workers_count = workers
+        self._partitions = partitions
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = {}
+        self._task = None
+        self._prices = {}  # streamed prices not forwarded to the workers yet
+
+    async def start(self):
+        for index in range(self._workers_count):
+            self._workers[index] = self._spawn(index)
+        # Round-robin initial assignment
+        for number in range(self._partitions):
+            self._workers[number % self._workers_count].partitions.add(number)
+        for worker in list(self._workers.values()):
+            await self._request(worker, "assign", worker.partitions)
+        self._task = asyncio.create_task(self._monitor())
+        logging.info(f"Coordinator started {self._workers_count} alert workers for {self._partitions} partitions")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for worker in self._workers.values():
+            try:
+                worker.conn.send(("stop", []))
+            except OSError:
+                pass
+        loop = asyncio.get_running_loop()
+        for worker in self._workers.values():
+            await loop.run_in_executor(None, worker.process.join, const.CLUSTER_ACK_TIMEOUT)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._workers.clear()
+
+    def on_price(self, currency: str, price: int):
+        # Price stream listener; prices streamed in the same loop iteration go out as one message
+        if not self._prices:
+            asyncio.get_running_loop().call_soon(self._forward_prices)
+        self._prices[currency] = price
+
+    def _forward_prices(self):
+        prices, self._prices = list(self._prices.items()), {}
+        for worker in self._workers.values():
+            try:
+                worker.conn.send(("prices", prices))
+            except OSError:
+                pass  # the monitor hands off its partitions
+
+    def _spawn(self, index: int) -> _Worker:
+        parent, child = self._context.Pipe()
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self._token, self._workers_count, child),
+            name=f"alert-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        return _Worker(index, process, parent)
+
+    async def _request(self, worker: _Worker, kind: str, partitions: set) -> bool:
+        # Sends a command and waits for the worker to confirm it has been applied
+        loop = asyncio.get_running_loop()
+        try:
+            worker.conn.send((kind, sorted(partitions)))
+            if not await loop.run_in_executor(None, worker.conn.poll, const.CLUSTER_ACK_TIMEOUT):
+                raise TimeoutError(f"no ack for {kind} within {const.CLUSTER_ACK_TIMEOUT}s")
+            worker.conn.recv()
+            return True
+        except (EOFError, OSError, TimeoutError) as e:
+            logging.error(f"Worker {worker.index} failed to {kind} partitions: {e}")
+            return False
+
+    def _least_loaded(self, exclude: Union[_Worker, None] = None) -> _Worker:
+        return min((worker for worker in self._workers.values() if worker is not exclude), key=lambda worker: len(worker.partitions))
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(1)
+            for index, worker in list(self._workers.items()):
+                if worker.process.is_alive():
+                    continue
+                logging.warning(f"Alert worker {index} exited with {worker.process.exitcode}, handing off its partitions")
+                await self._handoff(index, worker)
+
+    async def _handoff(self, index: int, dead: _Worker):
+        orphaned = dead.partitions
+        del self._workers[index]
+        dead.conn.close()
+
+        # A dead worker holds nothing, so its partitions can go to survivors right away
+        if self._workers:
+            for number in orphaned:
+                self._least_loaded().partitions.add(number)
+            for worker in list(self._workers.values()):
+                await self._request(worker, "assign", worker.partitions)
+            orphaned = set()
+
+        replacement = self._workers[index] = self._spawn(index)
+        replacement.partitions.update(orphaned)
+        await self._request(replacement, "assign", replacement.partitions)
+
+        # Rebalance onto the replacement: revoke first and only assign once the owner confirmed
+        target = self._partitions // len(self._workers)
+        while len(replacement.partitions) < target:
+            donor = max(self._workers.values(), key=lambda worker: len(worker.partitions))
+            if donor is replacement or len(donor.partitions) <= target:
+                break
+            moved = set(sorted(donor.partitions)[:len(donor.partitions) - target][:target - len(replacement.partitions)])
+            if not await self._request(donor, "revoke", moved):
+                break
+            donor.partitions -= moved
+            replacement.partitions |= moved
+            await self._request(replacement, "assign", moved)
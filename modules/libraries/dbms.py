@@ -1,44 +1,110 @@
 import aiosqlite
+import asyncio
 import logging
-from typing import Union
-from modules.libraries.utils import _Methods
+import time
+from typing import Iterable, Union
+from modules.libraries.cache import price_cache, UserCache, UserRecord
+from modules.libraries.metrics import metrics
+from modules.libraries.utils import const
 
 
 class Database:
-    def __init__(self, db: str):
+
+    UPDATABLE_COLUMNS = ("currency", "interval", "threshold", "last_rate")
+
+    def __init__(self, db: str, flush_interval: float = const.DATABASE_FLUSH_INTERVAL, flush_rows: int = const.DATABASE_FLUSH_ROWS):
         self.db_path = db
+        self._connection = None
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        # Write-behind buffer: user_id -> {column: value}, flushed in one transaction
+        self._flush_interval = flush_interval
+        self._flush_rows = flush_rows
+        self._pending = {}
+        self._waiters = []
+        self._flush_task = None
+        self._flush_now = None  # size triggered flush that hasn't taken the buffers yet
+        self._tasks = set()
+        self._ticks = []  # (symbol, ts, price) waiting for the next flush
+        self._outbox = []  # (user_id, created, text) alerts to store with the next flush
+        self._delivered = []  # (user_id, created) alerts sent, removed from the outbox with the next flush
+        self._last_compaction = time.time()
+        self.users = UserCache()
+
+    async def connection(self) -> aiosqlite.Connection:
+        if self._connection is None:
+            async with self._connect_lock:
+                if self._connection is None:
+                    # cached_statements keeps the prepared statements of the hot queries around
+                    connection = await aiosqlite.connect(self.db_path, cached_statements=const.DATABASE_CACHED_STATEMENTS)
+                    await connection.execute("PRAGMA journal_mode=WAL")
+                    await connection.execute("PRAGMA synchronous=NORMAL")
+                    self._connection = connection
+                    logging.info(f"Opened database connection to {self.db_path}")
+        return self._connection
+
+    async def close(self):
+        await self.flush()
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+            logging.info("Closed database connection")
 
     async def create_tables(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.cursor() as cursor:
-                await cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER UNIQUE,      
-                        user_name TEXT NOT NULL,      
-                        currency TEXT NOT NULL DEFAULT 'BTC',                                                     
-                        interval INTEGER NOT NULL DEFAULT 300,
-                        threshold INTEGER NOT NULL DEFAULT 50,
-                        last_rate INTEGER
-                    )
-                    """
+        db = await self.connection()
+        async with db.cursor() as cursor:
+            await cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER UNIQUE,      
+                    user_name TEXT NOT NULL,      
+                    currency TEXT NOT NULL DEFAULT 'BTC',                                                     
+                    interval INTEGER NOT NULL DEFAULT 300,
+                    threshold INTEGER NOT NULL DEFAULT 50,
+                    last_rate INTEGER
                 )
+                """
+            )
+            # (symbol, ts) primary key doubles as the range index, no separate rowid needed
+            await cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS price_ticks (
+                    symbol TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    price REAL NOT NULL,
+                    PRIMARY KEY (symbol, ts)
+                ) WITHOUT ROWID
+                """
+            )
+            # Alerts whose baseline is committed but which haven't been delivered yet
+            await cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS alert_outbox (
+                    user_id INTEGER NOT NULL,
+                    created INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    PRIMARY KEY (user_id, created)
+                ) WITHOUT ROWID
+                """
+            )
 
-                logging.info("Successfully created tables")
-                await db.commit()
+            logging.info("Successfully created tables")
+            await db.commit()
 
+    @metrics.timed("db")
     async def add_user(self, user_id: int, user_name: str) -> Union[bool, int]:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                async with db.cursor() as cursor:
-                        await cursor.execute(
-                            "INSERT INTO users (user_id, user_name) VALUES (?, ?)",
-                            (user_id, user_name)
-                        )
-                        await db.commit()
-                        logging.info(f"User {user_id} added successfully")
-                        return True
+            db = await self.connection()
+            async with self._write_lock, db.cursor() as cursor:
+                await cursor.execute(
+                    "INSERT INTO users (user_id, user_name) VALUES (?, ?)",
+                    (user_id, user_name)
+                )
+                await db.commit()
+                self.users.invalidate(user_id)
+                logging.info(f"User {user_id} added successfully")
+                return True
         except aiosqlite.IntegrityError:
             logging.info(f"User with ID {user_id} already exists")
             return 409
@@ -46,69 +112,318 @@ class Database:
             logging.error(f"Failed to add user {user_id}: {e}")
             return False
 
+    @metrics.timed("db")
     async def fetch_info(self, user_id: int) -> dict:
+        record = self.users.get(user_id)
+        if record is not None:
+            return record.as_dict()
         try:
-            async with aiosqlite.connect(self.db_path) as db:
-                async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT * FROM users WHERE user_id =?",
-                        (user_id,)
-                    )
-                    result = await cursor.fetchone()
-                    if result:
-                        return {
-                            "user_id": result[1],
-                            "user_name": result[2],
-                            "currency": result[3],
-                            "interval": result[4],
-                            "threshold": result[5],
-                            "last_rate": result[6]
-                        }
-                    else:
-                        logging.warning(f"No user found with ID {user_id}")
-                        return None
+            db = await self.connection()
+            async with db.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT user_id, user_name, currency, interval, threshold, last_rate FROM users WHERE user_id =?",
+                    (user_id,)
+                )
+                result = await cursor.fetchone()
+                if result:
+                    record = UserRecord(*result)
+                    for identity, value in self._overlay(user_id).items():
+                        setattr(record, identity, value)
+                    self.users.put(record)
+                    return record.as_dict()
+                else:
+                    logging.warning(f"No user found with ID {user_id}")
+                    return None
         except Exception as e:
             logging.error(f"Failed to fetch user info for user {user_id}: {e}")
             return None
 
-    async def info_updater(self, user_id: int, identity: str, value: any) -> bool:
+    def queue_update(self, user_id: int, identity: str, value: any) -> asyncio.Future:
+        if identity not in self.UPDATABLE_COLUMNS:
+            raise ValueError(f"Column {identity} can not be updated")
+        self._pending.setdefault(user_id, {})[identity] = value
+        self.users.update(user_id, identity, value)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+
+        self._schedule_flush()
+        # Resolves to True once the update is committed, await it when durability matters
+        return waiter
+
+    def record_tick(self, symbol: str, price: float, ts: int = None):
+        # Append-only price history, written in batches with the next flush
+        self._ticks.append((symbol.upper(), int(time.time()) if ts is None else ts, price))
+        self._schedule_flush()
+
+    def queue_alert(self, user_id: int, text: str) -> int:
+        # Stored in the same transaction as updates queued before the next await
+        created = time.time_ns()
+        self._outbox.append((user_id, created, text))
+        self._schedule_flush()
+        return created
+
+    def ack_alert(self, user_id: int, created: int):
+        # Delivered, so this alert and any older one for the user leave the outbox
+        self._delivered.append((user_id, created))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if len(self._pending) + len(self._ticks) + len(self._outbox) + len(self._delivered) >= self._flush_rows:
+            if self._flush_now is None:
+                self._flush_now = self._spawn(self.flush())
+        elif self._flush_task is None:
+            self._flush_task = self._spawn(self._delayed_flush())
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _delayed_flush(self):
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            await asyncio.sleep(self._flush_interval)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._write_lock:
+            pending, waiters, ticks = self._pending, self._waiters, self._ticks
+            outbox, delivered = self._outbox, self._delivered
+            self._pending, self._waiters, self._ticks = {}, [], []
+            self._outbox, self._delivered = [], []
+            # Rows queued from here on are for the next flush
+            self._flush_now = None
+            if not pending and not ticks and not outbox and not delivered:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(True)
+                return
+
+            columns = {}
+            for user_id, values in pending.items():
+                for identity, value in values.items():
+                    columns.setdefault(identity, []).append((value, user_id))
+
+            try:
+                db = await self.connection()
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        f"UPDATE users SET {identity} =? WHERE user_id =?",
-                        (value, user_id)
+                    for identity, rows in columns.items():
+                        await cursor.executemany(
+                            f"UPDATE users SET {identity} =? WHERE user_id =?",
+                            rows
+                        )
+                    await cursor.executemany(
+                        "INSERT OR REPLACE INTO price_ticks (symbol, ts, price) VALUES (?, ?, ?)",
+                        ticks
+                    )
+                    await cursor.executemany(
+                        "INSERT OR REPLACE INTO alert_outbox (user_id, created, text) VALUES (?, ?, ?)",
+                        outbox
+                    )
+                    await cursor.executemany(
+                        "DELETE FROM alert_outbox WHERE user_id =? AND created <=?",
+                        delivered
                     )
                     await db.commit()
-                    logging.info(f"User {user_id} updated successfully")
-                    return True
+                logging.info(f"Flushed updates for {len(pending)} users and {len(ticks)} price ticks in one transaction")
+                result = True
+            except Exception as e:
+                logging.error(f"Failed to flush updates for {len(pending)} users: {e}")
+                for user_id in pending:
+                    self.users.invalidate(user_id)
+                result = False
+
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(result)
+
+            if time.time() - self._last_compaction >= const.TICK_COMPACT_INTERVAL:
+                self._last_compaction = time.time()
+                await self._compact_ticks()
+
+    async def _compact_ticks(self):
+        # Raw ticks are kept for TICK_RAW_RETENTION, then thinned to the last tick of each
+        # TICK_DOWNSAMPLE bucket, and dropped entirely after TICK_RETENTION
+        now = int(time.time())
+        bucket = const.TICK_DOWNSAMPLE
+        try:
+            db = await self.connection()
+            async with db.cursor() as cursor:
+                await cursor.execute(
+                    "DELETE FROM price_ticks WHERE ts < ?",
+                    (now - const.TICK_RETENTION,)
+                )
+                expired = cursor.rowcount
+                await cursor.execute(
+                    """
+                    DELETE FROM price_ticks WHERE ts < :cutoff AND EXISTS (
+                        SELECT 1 FROM price_ticks AS newer
+                        WHERE newer.symbol = price_ticks.symbol
+                        AND newer.ts > price_ticks.ts
+                        AND newer.ts < (price_ticks.ts / :bucket + 1) * :bucket
+                    )
+                    """,
+                    {"cutoff": now - const.TICK_RAW_RETENTION, "bucket": bucket}
+                )
+                thinned = cursor.rowcount
+                await db.commit()
+            logging.info(f"Compacted price ticks: {expired} expired, {thinned} downsampled")
+        except Exception as e:
+            logging.error(f"Failed to compact price ticks: {e}")
+
+    def _overlay(self, user_id: int) -> dict:
+        # Updates still waiting for a flush, so reads never go back in time
+        return self._pending.get(user_id, {})
+
+    def _overlay_row(self, row: tuple) -> tuple:
+        pending = self._overlay(row[0])
+        if not pending:
+            return row
+        return (row[0], *(pending.get(identity, value) for identity, value in zip(self.UPDATABLE_COLUMNS, row[1:])))
+
+    @metrics.timed("db")
+    async def info_updater(self, user_id: int, identity: str, value: any) -> bool:
+        # Settings handlers only confirm a change once it is committed, which costs them up to
+        # DATABASE_FLUSH_INTERVAL of latency; concurrent updates still share one transaction
+        try:
+            successfully = await self.queue_update(user_id, identity, value)
+            if successfully:
+                logging.info(f"User {user_id} updated successfully")
+            return successfully
         except Exception as e:
             logging.error(f"Failed to update user {user_id}: {e}")
             return False
 
+    @metrics.timed("db")
     async def update_currency_price(self, user_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            udata = await self.fetch_info(user_id)
+            if udata:
+                currency = udata["currency"]
+                last_rate = await price_cache.get(currency)
+                self.queue_update(user_id, "last_rate", last_rate)
+                logging.info(f"Currency price for user {user_id} queued for update")
+                return True
+            else:
+                logging.warning(f"No currency found for user {user_id}")
+                return False
+        except Exception as e:
+            logging.error(f"Failed to get currency price for user {user_id}: {e}")
+            return False
+
+    @metrics.timed("db")
+    async def fetch_subscribers(self, partitions: Iterable[int] = None, modulo: int = const.CLUSTER_PARTITIONS) -> list:
+        # Every user, or only those with user_id % modulo in partitions
+        query, params = "SELECT user_id, currency, interval, threshold, last_rate FROM users", []
+        if partitions is not None:
+            params = sorted(partitions)
+            if not params:
+                return []
+            query += f" WHERE user_id % ? IN ({', '.join('?' * len(params))})"
+            params.insert(0, modulo)
+        try:
+            db = await self.connection()
+            async with db.cursor() as cursor:
+                await cursor.execute(query, params)
+                return [self._overlay_row(row) for row in await cursor.fetchall()]
+        except Exception as e:
+            logging.error(f"Failed to fetch subscribers: {e}")
+            return []
+
+    @metrics.timed("db")
+    async def fetch_outbox(self, partitions: Iterable[int] = None, modulo: int = const.CLUSTER_PARTITIONS) -> list:
+        # Newest undelivered alert per user, as (user_id, created, text)
+        query, params = "SELECT user_id, MAX(created), text FROM alert_outbox", []
+        if partitions is not None:
+            params = sorted(partitions)
+            if not params:
+                return []
+            query += f" WHERE user_id % ? IN ({', '.join('?' * len(params))})"
+            params.insert(0, modulo)
+        query += " GROUP BY user_id"
+        try:
+            # Under the write lock, so a flush can't be between taking the acks and committing them
+            async with self._write_lock:
+                db = await self.connection()
                 async with db.cursor() as cursor:
+                    await cursor.execute(query, params)
+                    rows = await cursor.fetchall()
+                delivered = {}
+                for user_id, created in self._delivered:
+                    delivered[user_id] = max(created, delivered.get(user_id, created))
+            return [row for row in rows if delivered.get(row[0], -1) < row[1]]
+        except Exception as e:
+            logging.error(f"Failed to fetch alert outbox: {e}")
+            return []
+
+    @metrics.timed("db")
+    async def fetch_currencies(self) -> list:
+        try:
+            db = await self.connection()
+            async with db.cursor() as cursor:
+                await cursor.execute("SELECT DISTINCT currency FROM users WHERE currency IS NOT NULL")
+                currencies = {row[0] for row in await cursor.fetchall()}
+            currencies.update(values["currency"] for values in self._pending.values() if values.get("currency"))
+            return sorted(currencies)
+        except Exception as e:
+            logging.error(f"Failed to fetch currencies: {e}")
+            return []
+
+    @metrics.timed("db")
+    async def fetch_many(self, user_ids: list) -> list:
+        if not user_ids:
+            return []
+        try:
+            db = await self.connection()
+            async with db.cursor() as cursor:
+                rows = []
+                for i in range(0, len(user_ids), 500):
+                    chunk = tuple(user_ids[i:i + 500])
+                    placeholders = ",".join("?" * len(chunk))
                     await cursor.execute(
-                        "SELECT currency FROM users WHERE user_id = ?",
-                        (user_id,)
+                        f"SELECT user_id, currency, interval, threshold, last_rate FROM users WHERE user_id IN ({placeholders})",
+                        chunk
                     )
-                    result = await cursor.fetchone()
-                    
-                    if result:
-                        currency = result[0]
-                        last_rate = await _Methods.get_currency_price(currency)
-                        await cursor.execute(
-                            "UPDATE users SET last_rate = ? WHERE user_id = ?",
-                            (last_rate, user_id)
-                        )
-                        await db.commit()
-                        logging.info(f"Currency price for user {user_id} updated successfully")
-                        return True
-                    else:
-                        logging.warning(f"No currency found for user {user_id}")
-                        return False
+                    rows.extend(await cursor.fetchall())
+                return [self._overlay_row(row) for row in rows]
         except Exception as e:
-            logging.error(f"Failed to get currency price for user {user_id}: {e}")
+            logging.error(f"Failed to fetch users {user_ids}: {e}")
+            return []
+
+    @metrics.timed("db")
+    async def update_last_rates(self, rates: list) -> bool:
+        if not rates:
+            return True
+        try:
+            waiters = [self.queue_update(user_id, "last_rate", price) for price, user_id in rates]
+            successfully = all(await asyncio.gather(*waiters))
+            if successfully:
+                logging.info(f"Updated last rate for {len(rates)} users")
+            return successfully
+        except Exception as e:
+            logging.error(f"Failed to update last rates: {e}")
             return False
+
+    @metrics.timed("db")
+    async def fetch_ticks(self, symbol: str, start: int, end: int = None) -> list:
+        symbol = symbol.upper()
+        end = int(time.time()) + 1 if end is None else end
+        # Ticks still waiting for a flush are part of the history too, taken before the query
+        # so a flush running meanwhile can't hide them
+        pending = {ts: price for tick_symbol, ts, price in self._ticks if tick_symbol == symbol and start <= ts < end}
+        try:
+            db = await self.connection()
+            async with db.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT ts, price FROM price_ticks WHERE symbol = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                    (symbol, start, end)
+                )
+                rows = await cursor.fetchall()
+            if pending:
+                rows = sorted({**dict(rows), **pending}.items())
+            return rows
+        except Exception as e:
+            logging.error(f"Failed to fetch price ticks for {symbol}: {e}")
+            return []
@@ -0,0 +1,84 @@
+import datetime, io, logging
+
+# pandas and matplotlib are imported inside the methods that use them,
+# so importing this module (e.g. from the handlers) costs nothing until a forecast runs
+
+
+class CryptoTracker:
+    def __init__(self, symbol, interval='1d', days_back=60, model='linear'):
+        self.symbol = symbol
+        self.interval = interval
+        self.days_back = days_back
+        from modules.libraries.models import get_model
+        self.model = get_model(model)
+
+    def fetch_data(self):
+        # Served from the local candle store, only candles newer than the stored ones are downloaded
+        from modules.libraries.candles import candle_store
+        return self.series(candle_store.history(self.symbol, self.interval, self.days_back))
+
+    @staticmethod
+    def series(candles):
+        import pandas as pd
+        return pd.Series(candles['close'], index=pd.to_datetime(candles['ts'], unit='s'))
+
+    def forecast(self, data, days=7):
+        # Same batched models as batch_forecast, with a batch of one
+        return self.model.predict(data.values.reshape(1, -1), days)[0]
+
+    def plot_and_analyze(self, data, forecast):
+        # Figure/Agg instead of pyplot: no global state, safe to render in parallel
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        figure = Figure(figsize=(10, 5))
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+        ax.plot(data.index, data.values, label='Historical Price')
+
+        forecast_dates = [data.index[-1] + datetime.timedelta(days=i + 1) for i in range(len(forecast))]
+        ax.plot(forecast_dates, forecast, label='Forecast', linestyle='--')
+
+        ax.set_title(f'{self.symbol} Price Forecast')
+        ax.set_xlabel('Date')
+        ax.set_ylabel('Price in USD')
+        ax.legend()
+        ax.grid()
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format='png')
+        chart = buffer.getvalue()
+        logging.info(f"Forecast price graph for {self.symbol} rendered ({len(chart)} bytes)")
+
+        trend = "upward" if forecast[-1] > data.values[-1] else "downward"
+        forecasted = f"{forecast[0].item():.2f}"
+        logging.info(f"Analysis: The forecast indicates an {trend} trend in the next period.")
+        logging.info(f"Predicted closing price for the next day: {forecasted} USD")
+        return forecasted, chart
+
+    def run_analysis(self):
+        data = self.fetch_data()
+        forecast = self.forecast(data)
+        forecasted, chart = self.plot_and_analyze(data, forecast)
+
+        logging.info("Analysis complete.")
+
+        return forecasted, chart, self.last_candle(data)
+
+    @staticmethod
+    def last_candle(data):
+        # Start of the newest candle the forecast was built on, in unix seconds
+        return int(data.index[-1].timestamp())
+
+
+def precompute(symbols, interval='1d', days_back=60, model='linear', days=7):
+    # Fits every symbol in one vectorized pass, then renders each chart
+    from modules.libraries.models import batch_forecast, load_candles
+    candles = load_candles(symbols, interval, days_back)
+    results = {}
+    for symbol, forecast in batch_forecast(candles, model, days).items():
+        tracker = CryptoTracker(symbol=symbol, interval=interval, days_back=days_back, model=model)
+        data = tracker.series(candles[symbol])
+        try:
+            results[symbol] = (*tracker.plot_and_analyze(data, forecast), tracker.last_candle(data))
+        except Exception as e:
+            logging.error(f"Failed to render forecast for {symbol}: {e}")
+    return results
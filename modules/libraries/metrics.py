@@ -0,0 +1,206 @@
+import bisect, cProfile, functools, io, logging, pstats, random, time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Union
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from modules.libraries.utils import const
+
+
+class Histogram:
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: tuple = const.METRICS_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+class _Frame:
+    # Time spent in each kind of work while handling one update
+
+    __slots__ = ("spent", "child")
+
+    def __init__(self):
+        self.spent = defaultdict(float)
+        self.child = 0.0
+
+
+_frame: ContextVar[Union[_Frame, None]] = ContextVar("metrics_frame", default=None)
+
+
+class _Timer:
+
+    __slots__ = ("_metrics", "_kind", "_started", "_outer", "_token")
+
+    def __init__(self, metrics, kind: str):
+        self._metrics = metrics
+        self._kind = kind
+
+    def __enter__(self):
+        self._outer = _frame.get()
+        # Nested timers get their own frame so the outer one only counts its exclusive time
+        self._token = _frame.set(_Frame())
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._started
+        inner = _frame.get()
+        _frame.reset(self._token)
+        self._metrics.observe(f"{self._kind}_seconds", elapsed)
+        if self._outer is not None:
+            self._outer.spent[self._kind] += elapsed - inner.child
+            for kind, spent in inner.spent.items():
+                self._outer.spent[kind] += spent
+            self._outer.child += elapsed
+        return False
+
+
+class Metrics:
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        self._gauges = {}  # gauge name -> callable, read when rendering
+        self.started = time.time()
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        self.histograms[name].observe(value)
+
+    def gauge(self, name: str, callback: Callable[[], float]):
+        self._gauges[name] = callback
+
+    def timer(self, kind: str) -> _Timer:
+        # with metrics.timer("db"): charges the block to the update being handled
+        return _Timer(self, kind)
+
+    def timed(self, kind: str):
+        def decorator(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                with self.timer(kind):
+                    return await function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        # Prometheus text format, label values are part of the stored names
+        lines = [f"uptime_seconds {time.time() - self.started:.0f}"]
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name} {value}")
+        for name, callback in sorted(self._gauges.items()):
+            try:
+                lines.append(f"{name} {callback():g}")
+            except Exception as e:
+                logging.warning(f"Gauge {name} failed: {e}")
+        for name, histogram in sorted(self.histograms.items()):
+            base, _, labels = name.partition("{")
+            labels = labels.rstrip("}")
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{base}_bucket{{{labels + ',' if labels else ''}le=\"{le}\"}} {cumulative}")
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{base}_sum{suffix} {histogram.sum:.6f}")
+            lines.append(f"{base}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    # Inner middleware, so the matched handler is known and unmatched updates cost nothing
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        slow: float = const.METRICS_SLOW_UPDATE,
+        profile_rate: float = 0.0,
+    ):
+        self._metrics = metrics
+        self._slow = slow
+        self._profile_rate = profile_rate  # share of updates run under cProfile, 0 disables it
+        self._profiling = False  # one profiler at a time, they can't be nested
+        self.in_flight = 0
+        metrics.gauge("updates_in_flight", lambda: self.in_flight)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__.removesuffix("_command") if handler_object else "unknown"
+        labels = f'{{handler="{name}"}}'
+
+        profiler = None
+        if self._profile_rate and not self._profiling and random.random() < self._profile_rate:
+            profiler = cProfile.Profile()
+            self._profiling = True
+        frame = _Frame()
+        token = _frame.set(frame)
+        self.in_flight += 1
+        self._metrics.inc(f"updates_total{labels}")
+        started = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            return await handler(event, data)
+        except Exception:
+            self._metrics.inc(f"update_errors_total{labels}")
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            elapsed = time.perf_counter() - started
+            self.in_flight -= 1
+            _frame.reset(token)
+            self._metrics.observe(f"update_seconds{labels}", elapsed)
+            for kind, spent in frame.spent.items():
+                self._metrics.observe(f'update_{kind}_seconds{{handler="{name}"}}', spent)
+            if elapsed >= self._slow:
+                self._slow_update(name, elapsed, frame, profiler)
+
+    def _slow_update(self, name: str, elapsed: float, frame: _Frame, profiler: Union[cProfile.Profile, None]):
+        self._metrics.inc(f'slow_updates_total{{handler="{name}"}}')
+        split = ", ".join(f"{kind} {spent * 1000:.0f}ms" for kind, spent in sorted(frame.spent.items()))
+        logging.warning(f"Slow update in {name}: {elapsed * 1000:.0f}ms ({split or 'no timed work'})")
+        if profiler is not None:
+            # The profiler sees every task that ran meanwhile, not only this update
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(20)
+            logging.warning(f"Profile of slow update in {name}:\n{output.getvalue()}")
+
+
+async def serve_metrics(metrics: Metrics, host: str, port: int):
+    # Standalone endpoint for polling mode, webhook mode adds the route to its own app
+    from aiohttp import web
+    app = web.Application()
+    app.router.add_get(const.METRICS_PATH, metrics_handler(metrics))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Serving metrics on http://{host}:{port}{const.METRICS_PATH}")
+    return runner
+
+
+def metrics_handler(metrics: Metrics):
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain")
+    return handle
+
+
+metrics = Metrics()
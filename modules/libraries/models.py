@@ -0,0 +1,123 @@
+import logging
+from typing import Dict, Iterable
+import numpy as np
+
+# Every model works on a 2-D array of closes, one row per symbol, oldest first.
+# Rows are right-aligned and shorter histories are padded with NaN on the left,
+# so the whole batch is fitted in a handful of array operations.
+
+
+class LinearTrend:
+    # Closed-form least squares of close ~ a + b * t, per row
+
+    def predict(self, closes: np.ndarray, days: int) -> np.ndarray:
+        count = closes.shape[1]
+        valid = ~np.isnan(closes)
+        x = np.broadcast_to(np.arange(count, dtype="<f8"), closes.shape)
+        y = np.where(valid, closes, 0.0)
+        x = np.where(valid, x, 0.0)
+
+        n = valid.sum(axis=1)
+        sx, sy = x.sum(axis=1), y.sum(axis=1)
+        sxx, sxy = (x * x).sum(axis=1), (x * y).sum(axis=1)
+        denominator = n * sxx - sx * sx
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = np.where(denominator != 0, (n * sxy - sx * sy) / denominator, 0.0)
+            intercept = (sy - slope * sx) / n
+
+        future = np.arange(count, count + days, dtype="<f8")
+        return intercept[:, None] + slope[:, None] * future[None, :]
+
+
+class EMA:
+    # Exponential moving average, the forecast stays flat at the last smoothed level
+
+    def __init__(self, alpha: float = 0.3):
+        self.alpha = alpha
+
+    def predict(self, closes: np.ndarray, days: int) -> np.ndarray:
+        level = np.full(closes.shape[0], np.nan)
+        for column in closes.T:
+            valid = ~np.isnan(column)
+            level = np.where(valid, np.where(np.isnan(level), column, self.alpha * column + (1 - self.alpha) * level), level)
+        return np.repeat(level[:, None], days, axis=1)
+
+
+class Holt:
+    # Holt's linear method: smoothed level plus smoothed trend
+
+    def __init__(self, alpha: float = 0.5, beta: float = 0.3):
+        self.alpha = alpha
+        self.beta = beta
+
+    def predict(self, closes: np.ndarray, days: int) -> np.ndarray:
+        rows = closes.shape[0]
+        level = np.full(rows, np.nan)
+        trend = np.full(rows, np.nan)
+        for column in closes.T:
+            valid = ~np.isnan(column)
+            first = valid & np.isnan(level)
+            second = valid & ~np.isnan(level) & np.isnan(trend)
+            update = valid & ~first & ~second
+
+            smoothed = self.alpha * column + (1 - self.alpha) * (level + np.nan_to_num(trend))
+            new_trend = self.beta * (smoothed - level) + (1 - self.beta) * trend
+
+            trend = np.where(second, column - level, np.where(update, new_trend, trend))
+            level = np.where(first | second, column, np.where(update, smoothed, level))
+
+        steps = np.arange(1, days + 1, dtype="<f8")
+        return level[:, None] + np.nan_to_num(trend)[:, None] * steps[None, :]
+
+
+MODELS = {
+    "linear": LinearTrend,
+    "ema": EMA,
+    "holt": Holt,
+}
+
+
+def get_model(name: str, **params):
+    try:
+        return MODELS[name](**params)
+    except KeyError:
+        raise ValueError(f"Unknown forecast model {name!r}, expected one of {', '.join(MODELS)}")
+
+
+def stack_closes(series: Iterable[np.ndarray]) -> np.ndarray:
+    series = list(series)
+    width = max((len(closes) for closes in series), default=0)
+    stacked = np.full((len(series), width), np.nan)
+    for row, closes in enumerate(series):
+        if len(closes):
+            stacked[row, width - len(closes):] = closes
+    return stacked
+
+
+def load_candles(symbols: Iterable[str], interval: str = "1d", days_back: int = 60) -> Dict[str, np.ndarray]:
+    # Reads every symbol from the candle store, downloading only the candles it is missing
+    from modules.libraries.candles import candle_store
+    loaded = {}
+    for symbol in symbols:
+        try:
+            candles = candle_store.history(symbol, interval, days_back)
+        except Exception as e:
+            logging.error(f"Failed to load candles for {symbol}: {e}")
+            continue
+        if len(candles):
+            loaded[symbol] = candles
+    return loaded
+
+
+def batch_forecast(
+    candles: Dict[str, np.ndarray],
+    model: str = "linear",
+    days: int = 7,
+    **params,
+) -> Dict[str, np.ndarray]:
+    # One fit for every symbol returned by load_candles
+    if not candles:
+        return {}
+    forecasts = get_model(model, **params).predict(stack_closes(rows["close"] for rows in candles.values()), days)
+    logging.info(f"Forecasted {len(candles)} symbols with {model} in one pass")
+    return dict(zip(candles, forecasts))
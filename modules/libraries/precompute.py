@@ -0,0 +1,90 @@
+import argparse, asyncio, logging, time
+from modules.libraries.cache import ForecastCache
+from modules.libraries.catalog import symbol_catalog
+from modules.libraries.dbms import Database
+from modules.libraries.utils import const
+from modules.libraries.workers import ForecastPool, forecast_pool
+
+
+class ForecastPrecompute:
+
+    def __init__(
+        self,
+        db: Database,
+        pool: ForecastPool = forecast_pool,
+        interval: str = "1d",
+        days_back: int = 60,
+        delay: float = const.FORECAST_PRECOMPUTE_DELAY,
+    ):
+        self._db = db
+        self._pool = pool
+        self._interval = interval
+        self._days_back = days_back
+        self._delay = delay  # lets the exchange publish the closed candle first
+        self._task = None
+
+    async def start(self):
+        # The first pass warms the cache right away, later ones follow each candle close
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def next_run(self, now: float = None) -> float:
+        now = time.time() if now is None else now
+        return ForecastCache.candle(self._interval, now) + ForecastCache.step(self._interval) + self._delay
+
+    async def symbols(self) -> list:
+        # Same symbols GetForeCast asks for
+        currencies = await self._db.fetch_currencies()
+        return [f"{currency}-USD" for currency in currencies if symbol_catalog.is_known(currency)]
+
+    async def run_once(self) -> int:
+        symbols = await self.symbols()
+        started = time.monotonic()
+        computed = await self._pool.precompute(symbols, self._interval, self._days_back)
+        logging.info(f"Forecast precompute for {len(symbols)} currencies took {time.monotonic() - started:.1f}s, {computed} computed")
+        return computed
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+                # Symbols whose closed candle wasn't published yet are retried before the next close
+                behind = self._pool.missing(await self.symbols(), self._interval, self._days_back)
+            except Exception as e:
+                logging.error(f"Forecast precompute failed: {e}")
+                behind = []
+            delay = max(self.next_run() - time.time(), 0)
+            if behind:
+                delay = min(delay, const.FORECAST_PRECOMPUTE_RETRY)
+            await asyncio.sleep(delay)
+
+
+async def main(args):
+    database = Database(const.DATABASE_NAME)
+    try:
+        await database.create_tables()
+        await ForecastPrecompute(database, interval=args.interval, days_back=args.days_back).run_once()
+    finally:
+        forecast_pool.shutdown()
+        await database.close()
+
+
+if __name__ == "__main__":
+    # python -m modules.libraries.precompute, e.g. from cron when the bot runs elsewhere
+    parser = argparse.ArgumentParser(description="Precompute forecasts for every tracked currency")
+    parser.add_argument("--interval", default="1d")
+    parser.add_argument("--days-back", type=int, default=60)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s]:%(levelname)s:%(funcName)s:%(message)s",
+        datefmt="%Y-%m-%d|%H:%M:%S",
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,194 @@
+import asyncio, heapq, logging, random, time
+from collections import defaultdict
+from functools import partial
+from typing import Callable, Iterable, Union
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from modules.libraries.alerts import AlertEngine
+from modules.libraries.dbms import Database
+from modules.libraries.cache import price_cache
+from modules.libraries.catalog import symbol_catalog
+from modules.libraries.sender import send_queue, SendQueue
+from modules.libraries.stream import price_stream
+from modules.libraries.utils import const, _Messages
+
+
+class AlertScheduler:
+
+    def __init__(
+        self,
+        db: Database,
+        bot: Bot,
+        tick: float = const.SCHEDULER_TICK,
+        resync: float = const.SCHEDULER_RESYNC,
+        owns: Callable[[int], bool] = lambda user_id: True,
+        partitions: Union[Callable[[], Iterable[int]], None] = None,
+    ):
+        self._db = db
+        self._bot = bot
+        self._tick = tick
+        self._resync = resync
+        self._owns = owns  # which users this scheduler sends alerts for
+        self._partitions = partitions  # owned partitions, so resync only reads their rows
+        self._heap = []  # (next_fire, user_id), stale entries are skipped on pop
+        self._next_fire = {}
+        self._queued = {}  # user_id -> created of the alert posted to the send queue and not acked yet
+        self._engine = AlertEngine()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def start(self):
+        await self.resync()
+        self._task = asyncio.create_task(self._run())
+        logging.info(f"Alert scheduler started with {len(self._next_fire)} subscribers")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, user_id: int, interval: int = 0, now: float = None):
+        when = (time.monotonic() if now is None else now) + max(interval, 0)
+        self._next_fire[user_id] = when
+        heapq.heappush(self._heap, (when, user_id))
+
+    def on_price(self, currency: str, price: int):
+        # Streamed price: users whose band it crosses are checked on the next tick instead of
+        # waiting for their interval
+        now = time.monotonic()
+        for user_id in self._engine.crossed(currency, price):
+            if self._next_fire.get(user_id, now) > now:
+                self.schedule(user_id, now=now)
+
+    async def resync(self):
+        # Picks up users added elsewhere (another process, or before we owned them)
+        now = time.monotonic()
+        async with self._lock:
+            currencies = set()
+            partitions = None if self._partitions is None else self._partitions()
+            for user_id, currency, interval, threshold, last_rate in await self._db.fetch_subscribers(partitions):
+                if not self._owns(user_id):
+                    continue
+                currencies.add(currency)
+                if user_id not in self._next_fire:
+                    self._engine.upsert(user_id, currency, threshold, last_rate)
+                    # A random first delay spreads users on the same interval over the whole interval
+                    self.schedule(user_id, random.uniform(0, interval), now=now)
+            currencies = {currency for currency in currencies if symbol_catalog.is_known(currency)}
+            price_cache.track(currencies)
+            price_stream.track(currencies)
+            await self.replay()
+
+    async def revoke(self, predicate: Callable[[int], bool]):
+        # Waits for the running tick, so once this returns no alert for these users is in progress.
+        # Their queued alerts stay in the outbox for the next owner, sent ones are acked first
+        async with self._lock:
+            for user_id in [user_id for user_id in self._next_fire if predicate(user_id)]:
+                del self._next_fire[user_id]
+                self._engine.remove(user_id)
+            send_queue.cancel(predicate)
+            await send_queue.settle()
+            for user_id in [user_id for user_id in self._queued if predicate(user_id)]:
+                del self._queued[user_id]
+            await self._db.flush()
+
+    async def replay(self):
+        # Alerts committed by a previous owner (or before a restart) but never delivered
+        partitions = None if self._partitions is None else self._partitions()
+        replayed = 0
+        for user_id, created, text in await self._db.fetch_outbox(partitions):
+            if self._owns(user_id) and self._queued.get(user_id, -1) < created:
+                self._post(user_id, text, created)
+                replayed += 1
+        if replayed:
+            logging.info(f"Replayed {replayed} undelivered alerts from the outbox")
+
+    def _post(self, user_id: int, text: str, created: int):
+        self._queued[user_id] = created
+        send_queue.post(user_id, partial(self._deliver, user_id, text, created), priority=SendQueue.ALERT)
+
+    async def _deliver(self, user_id: int, text: str, created: int):
+        try:
+            await self._bot.send_message(user_id, text)
+        except (TelegramBadRequest, TelegramForbiddenError):
+            # Blocked bot or a gone chat, another owner wouldn't get it through either
+            self._ack(user_id, created)
+            raise
+        self._ack(user_id, created)
+
+    def _ack(self, user_id: int, created: int):
+        if self._queued.get(user_id, -1) <= created:
+            self._queued.pop(user_id, None)
+        self._db.ack_alert(user_id, created)
+
+    def _pop_due(self, now: float) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            when, user_id = heapq.heappop(self._heap)
+            if self._next_fire.get(user_id) == when:
+                del self._next_fire[user_id]
+                due.append(user_id)
+        return due
+
+    async def _run(self):
+        last_resync = time.monotonic()
+        while True:
+            try:
+                if time.monotonic() - last_resync >= self._resync:
+                    last_resync = time.monotonic()
+                    await self.resync()
+                await self.tick()
+            except Exception as e:
+                logging.error(f"Alert scheduler tick failed: {e}")
+            await asyncio.sleep(self._tick)
+
+    async def tick(self):
+        async with self._lock:
+            now = time.monotonic()
+            due = self._pop_due(now)
+            if not due:
+                return
+
+            groups = defaultdict(list)
+            for row in await self._db.fetch_many(due):
+                groups[row[1]].append(row)
+
+            updates, alerts = [], []
+            prices = await price_cache.get_many(groups)
+            for currency, rows in groups.items():
+                price = prices[currency.upper()]
+                for user_id, _, interval, _, _ in rows:
+                    self.schedule(user_id, interval, now=now)
+                if price is None:
+                    continue
+                self._process(currency, price, rows, updates, alerts)
+
+            # Alerts are queued to the outbox with no await before the baselines, so both commit in
+            # one transaction; whoever owns these users next replays what wasn't delivered
+            queued = [(user_id, text, self._db.queue_alert(user_id, text)) for user_id, text in alerts]
+            if not await self._db.update_last_rates(updates):
+                return
+            for user_id, text, created in queued:
+                self._post(user_id, text, created)
+
+    def _process(self, currency: str, price: int, rows: list, updates: list, alerts: list):
+        # Due rows are fresh from the database; upsert is a no-op unless the band changed, and
+        # each due user is checked against its own band instead of a range lookup over everyone
+        due = {row[0]: row for row in rows}
+        self._engine.upsert_many([(user_id, currency, threshold, last_rate) for user_id, _, _, threshold, last_rate in rows])
+
+        triggered = [user_id for user_id in due if self._engine.triggered(user_id, price)]
+        for user_id in triggered:
+            alerts.append((user_id, _Messages.get_alert_message(currency, due[user_id][4], price)))
+
+        if triggered:
+            logging.info(f"Queued {len(triggered)} {currency} alerts at {price}$")
+
+        # Alerted users and users without a baseline yet start over from this price
+        restarted = triggered + [user_id for user_id, row in due.items() if not row[4]]
+        self._engine.upsert_many([(user_id, currency, due[user_id][3], price) for user_id in restarted])
+        updates.extend((price, user_id) for user_id in restarted)
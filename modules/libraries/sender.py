@@ -0,0 +1,218 @@
+import asyncio, heapq, itertools, logging, time
+from collections import deque
+from typing import Awaitable, Callable, Union
+from aiogram.exceptions import TelegramRetryAfter
+from modules.libraries.utils import const
+
+
+class TokenBucket:
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        # Seconds until a token is available, 0 if one is available now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+
+    __slots__ = ("chat_id", "factory", "priority", "future", "created", "coalesce")
+
+    def __init__(self, chat_id: int, factory: Callable[[], Awaitable], priority: int, future: Union[asyncio.Future, None], coalesce: bool):
+        self.chat_id = chat_id
+        self.factory = factory
+        self.priority = priority
+        self.future = future
+        self.created = time.monotonic()
+        self.coalesce = coalesce
+
+
+class SendQueue:
+
+    INTERACTIVE = 0
+    ALERT = 1
+
+    def __init__(
+        self,
+        global_rate: float = const.SEND_GLOBAL_RATE,
+        chat_rate: float = const.SEND_CHAT_RATE,
+        chat_burst: float = const.SEND_CHAT_BURST,
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats = {}
+        self._ready = []  # (priority, seq, job)
+        self._waiting = []  # (ready_at, seq, job), chats that are out of tokens
+        self._alerts = {}  # chat_id -> pending alert job, newer alerts replace it
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0
+        self._worker = None
+        self._inflight = set()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self._latencies = deque(maxlen=1000)
+
+    def set_global_rate(self, rate: float):
+        self._global = TokenBucket(rate, max(rate, 1))
+
+    @property
+    def depth(self) -> int:
+        return len(self._ready) + len(self._waiting)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "coalesced": self.coalesced,
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+        }
+
+    def submit(self, chat_id: int, factory: Callable[[], Awaitable], priority: int = INTERACTIVE) -> asyncio.Future:
+        # Returns a future with the result of the Bot API call once it has been sent
+        future = asyncio.get_running_loop().create_future()
+        self._push(_Job(chat_id, factory, priority, future, coalesce=False))
+        return future
+
+    def post(self, chat_id: int, factory: Callable[[], Awaitable], priority: int = ALERT, coalesce: bool = True):
+        # Fire and forget, a pending alert for the same chat is replaced by the newer one
+        if coalesce:
+            pending = self._alerts.get(chat_id)
+            if pending is not None:
+                pending.factory = factory
+                self.coalesced += 1
+                return
+        job = _Job(chat_id, factory, priority, None, coalesce)
+        if coalesce:
+            self._alerts[chat_id] = job
+        self._push(job)
+
+    def cancel(self, predicate: Callable[[int], bool]) -> int:
+        # Drops pending alerts for the matching chats, sends already under way are not affected
+        cancelled = 0
+        for chat_id, job in list(self._alerts.items()):
+            if predicate(chat_id):
+                del self._alerts[chat_id]
+                job.factory = None
+                cancelled += 1
+        return cancelled
+
+    async def settle(self):
+        # Waits for the sends under way right now
+        if self._inflight:
+            await asyncio.gather(*list(self._inflight), return_exceptions=True)
+
+    def _push(self, job: _Job):
+        heapq.heappush(self._ready, (job.priority, next(self._seq), job))
+        self._wakeup.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= const.SEND_CHAT_BUCKETS:
+                # Drop buckets that have refilled completely, they are equal to fresh ones
+                now = time.monotonic()
+                for key, value in list(self._chats.items()):
+                    value.delay(now)
+                    if value.tokens >= value.capacity:
+                        del self._chats[key]
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, seq, job = heapq.heappop(self._waiting)
+                heapq.heappush(self._ready, (job.priority, seq, job))
+
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = max(self._paused_until - now, self._global.delay(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, seq, job = heapq.heappop(self._ready)
+            if job.factory is None:
+                continue
+            bucket = self._bucket(job.chat_id)
+            chat_delay = bucket.delay(now)
+            if chat_delay > 0:
+                heapq.heappush(self._waiting, (now + chat_delay, seq, job))
+                continue
+
+            bucket.take()
+            self._global.take()
+            if job.coalesce and self._alerts.get(job.chat_id) is job:
+                del self._alerts[job.chat_id]
+            task = asyncio.create_task(self._send(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, job: _Job):
+        try:
+            result = await job.factory()
+        except TelegramRetryAfter as e:
+            # Flood control hit: hold every send for the requested time, then try this one again
+            logging.warning(f"Telegram asked to retry after {e.retry_after}s (chat {job.chat_id})")
+            self.retried += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            heapq.heappush(self._ready, (job.priority, next(self._seq), job))
+            self._wakeup.set()
+            return
+        except Exception as e:
+            self.failed += 1
+            if job.future is not None:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                logging.error(f"Failed to send message to chat {job.chat_id}: {e}")
+            return
+
+        self.sent += 1
+        self._latencies.append(time.monotonic() - job.created)
+        if job.future is not None and not job.future.done():
+            job.future.set_result(result)
+
+
+send_queue = SendQueue()
@@ -0,0 +1,143 @@
+import asyncio, json, logging, random, re, time
+from typing import Callable, Iterable, Union
+import aiohttp
+from modules.libraries.utils import const
+
+
+class PriceStream:
+    # One websocket to the exchange ticker feed for every tracked currency
+
+    def __init__(
+        self,
+        url: Union[str, None] = const.PRICE_STREAM_URL,
+        backoff: float = const.PRICE_STREAM_BACKOFF,
+        max_backoff: float = const.PRICE_STREAM_MAX_BACKOFF,
+    ):
+        self._url = url
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._tracked = set()
+        self._subscribed = set()
+        self._rejected = set()  # currencies the exchange has no USD ticker for, never subscribed again
+        self._listeners = []
+        self._ws = None
+        self._task = None
+        self._subscribing = None
+        self.latest = {}  # currency -> (price, received_at)
+        self.ticks = 0
+        self.reconnects = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._url is not None
+
+    def add_listener(self, listener: Callable[[str, int], None]):
+        # Called with every streamed price that differs from the previous one
+        self._listeners.append(listener)
+
+    def track(self, currencies: Iterable[str]):
+        self._tracked.update(currency.upper() for currency in currencies)
+        self._tracked -= self._rejected
+        if self._ws is not None and self._tracked - self._subscribed:
+            self._subscribing = asyncio.create_task(self._subscribe())
+
+    def add(self, currency: str):
+        self.track([currency])
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logging.info(f"Price stream started for {len(self._tracked)} currencies")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        attempt = 0
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    async with session.ws_connect(self._url, heartbeat=const.PRICE_STREAM_HEARTBEAT) as ws:
+                        self._ws = ws
+                        self._subscribed = set()
+                        await self._subscribe()
+                        attempt = 0
+                        async for message in ws:
+                            if message.type == aiohttp.WSMsgType.TEXT:
+                                self._handle(message.data)
+                            elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                                break
+                    logging.warning("Price stream closed by the server")
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    logging.warning(f"Price stream connection failed: {e!r}")
+                finally:
+                    self._ws = None
+                # Full jitter exponential backoff, reset once a connection is established
+                delay = random.uniform(0, min(self._max_backoff, self._backoff * 2 ** attempt))
+                attempt += 1
+                self.reconnects += 1
+                await asyncio.sleep(delay)
+
+    async def _subscribe(self):
+        ws, pending = self._ws, sorted(self._tracked - self._subscribed)
+        if ws is None or not pending:
+            return
+        self._subscribed.update(pending)
+        try:
+            await ws.send_json({
+                "type": "subscribe",
+                "product_ids": [f"{currency}-USD" for currency in pending],
+                "channels": ["ticker"],
+            })
+            logging.info(f"Subscribed to {len(pending)} tickers")
+        except (aiohttp.ClientError, ConnectionError) as e:
+            # The reconnect resubscribes everything
+            logging.warning(f"Failed to subscribe to tickers: {e!r}")
+
+    def _error(self, message: dict):
+        # A subscription to a product the exchange doesn't list (fiat, coins without a USD book)
+        # fails the whole connection, so those currencies are dropped before the reconnect
+        reason = f"{message.get('message')} {message.get('reason') or ''}".rstrip()
+        rejected = {currency for currency in re.findall(r"\b([A-Z0-9]+)-USD\b", reason) if currency in self._tracked}
+        if rejected:
+            self._rejected |= rejected
+            self._tracked -= rejected
+            self._subscribed -= rejected
+            logging.error(f"Price stream rejected {', '.join(sorted(rejected))}, no longer streamed: {reason}")
+        else:
+            logging.error(f"Price stream error: {reason}")
+
+    def _handle(self, data: str):
+        try:
+            message = json.loads(data)
+            if message.get("type") == "error":
+                self._error(message)
+                return
+            if message.get("type") != "ticker":
+                return
+            currency, quote = message["product_id"].split("-", 1)
+            if quote != "USD":
+                return
+            price = int(round(float(message["price"])))
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Unexpected ticker message {data[:200]}: {e}")
+            return
+        previous = self.latest.get(currency)
+        self.latest[currency] = (price, time.monotonic())
+        self.ticks += 1
+        if previous is not None and previous[0] == price:
+            return
+        for listener in self._listeners:
+            try:
+                listener(currency, price)
+            except Exception as e:
+                logging.error(f"Price stream listener failed for {currency}: {e}")
+
+
+price_stream = PriceStream()
@@ -1,15 +1,73 @@
-import random, string, aiohttp, logging, asyncio, datetime
+import html, random, string, logging
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.state import State, StatesGroup
-from typing import Union
-import yfinance as yf
-import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
-import numpy as np
+from typing import Dict, Union
+from modules.libraries.client import HttpClient
 
 
 class const:
     DATABASE_NAME = "database/spy.db"
+    DATABASE_CACHED_STATEMENTS = 64
+    DATABASE_FLUSH_INTERVAL = 0.05  # seconds queued updates wait before being committed
+    DATABASE_FLUSH_ROWS = 1000  # queued user updates and price ticks that force an immediate flush
+    TICK_RAW_RETENTION = 86400  # seconds every polled price is kept as is
+    TICK_DOWNSAMPLE = 300  # older ticks are thinned to one per this many seconds
+    TICK_RETENTION = 90 * 86400  # seconds before ticks are dropped
+    TICK_COMPACT_INTERVAL = 3600
+    SCHEDULER_TICK = 1  # seconds between due-time checks
+    SCHEDULER_RESYNC = 60  # seconds between checks for users added by another process
+    CLUSTER_PARTITIONS = 64  # user_id partitions spread over alert worker processes
+    CLUSTER_ACK_TIMEOUT = 30  # seconds a worker has to confirm an assignment change
+    PRICE_CACHE_TTL = 10  # seconds a spot price is served without refetching
+    PRICE_CACHE_STALE_TTL = 50  # seconds a stale price is served while refreshing in background
+    PRICE_BULK_FETCH = True  # refresh prices from one exchange-rates response instead of one request per symbol
+    PRICE_CACHE_SIZE = 256
+    SYMBOL_CATALOG_PATH = "database/symbols.json"
+    SYMBOL_CATALOG_REFRESH = 86400  # seconds between catalog downloads
+    SYMBOL_CATALOG_RETRY = 300  # seconds before a failed download is retried
+    PRICE_STREAM_URL = None  # ticker websocket, e.g. wss://ws-feed.exchange.coinbase.com, None keeps polling only
+    PRICE_STREAM_BACKOFF = 1  # seconds, doubled on every failed reconnect
+    PRICE_STREAM_MAX_BACKOFF = 60
+    PRICE_STREAM_HEARTBEAT = 30
+    USER_CACHE_SIZE = 10000
+    COINBASE_API_URL = "https://api.coinbase.com"  # point at a local stub in tests
+    HTTP_LIMIT = 100
+    HTTP_LIMIT_PER_HOST = 20
+    HTTP_KEEPALIVE = 30
+    HTTP_TIMEOUT = 10
+    HTTP_RETRIES = 3
+    HTTP_BACKOFF = 0.5
+    SEND_GLOBAL_RATE = 30  # messages per second across all chats, Telegram's broadcast limit
+    SEND_MAIN_SHARE = 0.3  # part of the global rate the main process keeps when alert workers run
+    SEND_CHAT_RATE = 1  # messages per second to a single chat
+    SEND_CHAT_BURST = 3
+    SEND_CHAT_BUCKETS = 10000  # per-chat buckets kept before idle ones are dropped
+    WEBHOOK_HOST = "127.0.0.1"
+    WEBHOOK_PORT = 8080
+    WEBHOOK_PATH = "/webhook"
+    WEBHOOK_URL = None  # public base url, e.g. https://bot.example.com
+    WEBHOOK_SECRET = None  # X-Telegram-Bot-Api-Secret-Token checked on incoming updates
+    FSM_REDIS_URL = None  # e.g. redis://localhost:6379/0, required when several instances serve updates
+    METRICS_PATH = "/metrics"
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+    METRICS_SLOW_UPDATE = 1  # seconds, slower updates are logged with their time split
+    FORECAST_WORKERS = 2  # forecasts computed in parallel
+    FORECAST_QUEUE_SIZE = 8  # forecasts allowed to wait for a worker before replying busy
+    FORECAST_CACHE_DIR = "database/forecasts"
+    FORECAST_PRECOMPUTE_DELAY = 300  # seconds after the daily candle closes before forecasts are precomputed
+    FORECAST_PRECOMPUTE_RETRY = 600  # retry delay for forecasts whose last closed candle was not published yet
+    CANDLE_STORE_DIR = "database/candles"
+    FORECAST_CACHE_MAX_AGE = 2 * 86400  # seconds
+    FORECAST_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+http_client = HttpClient(
+    limit=const.HTTP_LIMIT,
+    limit_per_host=const.HTTP_LIMIT_PER_HOST,
+    keepalive_timeout=const.HTTP_KEEPALIVE,
+    timeout=const.HTTP_TIMEOUT,
+    retries=const.HTTP_RETRIES,
+    backoff=const.HTTP_BACKOFF,
+)
 
 class _Kbs:
 
@@ -106,80 +164,60 @@ class _Messages:
             """
         )
 
+    @staticmethod
+    def get_unknown_currency_message(currency: str) -> str:
+        return f"Валюта {html.escape(currency)} не поддерживается, напишите код (например BTC) или название (например Bitcoin)"
 
-class _Methods:
+    @staticmethod
+    def get_forecast_busy_message() -> str:
+        return "Сейчас строится слишком много прогнозов, попробуйте через минуту"
+
+    @staticmethod
+    def get_alert_message(currency: str, last_rate: int, price: int) -> str:
+        change = (price - last_rate) / last_rate * 100
+        return(f"""
+            <b>{'📈' if change > 0 else '📉'} {currency}: {change:+.2f}%</b>
+            <b>Было: {last_rate}$</b>
+            <b>Стало: {price}$</b>
+        """)
 
-    @staticmethod  
-    async def get_currency_price(symbol: str) -> Union[int, None]:
-        url = f"https://api.coinbase.com/v2/prices/{symbol}-USD/spot"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    try:
-                        price = round(float(data["data"]["amount"]))
-                        return int(price)
-                    except (KeyError, TypeError, ValueError):
-                        logging.error(f"Unexpected data format: {data}")
-                        return None
-                else:
-                    logging.error(f"Failed to fetch price for {symbol}: {response.status}")
-                    return None
-
-
-class CryptoTracker:
-    def __init__(self, symbol, interval='1d', days_back=60):
-        self.symbol = symbol
-        self.interval = interval
-        self.days_back = days_back
-        self.model = LinearRegression()
-
-    def fetch_data(self):
-        end_date = datetime.datetime.now()
-        start_date = end_date - datetime.timedelta(days=self.days_back)
-        data = yf.download(self.symbol, start=start_date, end=end_date, interval=self.interval)
-        return data['Close']
-
-    def train_model(self, data):
-        X = np.arange(len(data)).reshape(-1, 1)
-        self.model.fit(X, data.values)
-
-    def forecast(self, data, days=7):
-        future_X = np.arange(len(data), len(data) + days).reshape(-1, 1)
-        return self.model.predict(future_X)
-
-    def plot_and_analyze(self, data, forecast):
-        plt.figure(figsize=(10, 5))
-        plt.plot(data.index, data.values, label='Historical Price')
-        
-        forecast_dates = [data.index[-1] + datetime.timedelta(days=i + 1) for i in range(len(forecast))]
-        plt.plot(forecast_dates, forecast, label='Forecast', linestyle='--')
-        
-        plt.title(f'{self.symbol} Price Forecast')
-        plt.xlabel('Date')
-        plt.ylabel('Price in USD')
-        plt.legend()
-        plt.grid()
-        plt.savefig(f'{self.symbol}-FORECAST-PRICE.png')
-        plt.close()
-        logging.info(f"Forecast price graph saved as '{self.symbol}-FORECAST-PRICE.png.'")
-
-        trend = "upward" if forecast[-1] > data.values[-1] else "downward"
-        forecasted = f"{forecast[0].item():.2f}"
-        logging.info(f"Analysis: The forecast indicates an {trend} trend in the next period.")
-        logging.info(f"Predicted closing price for the next day: {forecasted} USD")
-        return forecasted
-
-    def run_analysis(self):
-        data = self.fetch_data()
-        self.train_model(data)
-        
-        forecast = self.forecast(data)
-        forecasted = self.plot_and_analyze(data, forecast)
-        
-        logging.info("Analysis complete.")
-
-        return forecasted
 
+class _Methods:
 
+    @staticmethod
+    async def get_currency_price(symbol: str) -> Union[int, None]:
+        url = f"{const.COINBASE_API_URL}/v2/prices/{symbol}-USD/spot"
+        status, data = await http_client.get_json(url)
+        if status == 200:
+            try:
+                price = round(float(data["data"]["amount"]))
+                return int(price)
+            except (KeyError, TypeError, ValueError):
+                logging.error(f"Unexpected data format: {data}")
+                return None
+        else:
+            logging.error(f"Failed to fetch price for {symbol}: {status}")
+            return None
 
+    @staticmethod
+    async def get_exchange_rates() -> Dict[str, int]:
+        # Units of each currency per dollar, so the dollar price is the inverse
+        url = f"{const.COINBASE_API_URL}/v2/exchange-rates"
+        status, data = await http_client.get_json(url, params={"currency": "USD"})
+        if status != 200:
+            logging.error(f"Failed to fetch exchange rates: {status}")
+            return {}
+        try:
+            rates = data["data"]["rates"]
+        except (KeyError, TypeError):
+            logging.error(f"Unexpected data format: {data}")
+            return {}
+        prices = {}
+        for symbol, rate in rates.items():
+            try:
+                rate = float(rate)
+            except (TypeError, ValueError):
+                continue
+            if rate > 0:
+                prices[symbol.upper()] = int(round(1 / rate))
+        return prices
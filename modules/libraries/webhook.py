@@ -0,0 +1,43 @@
+import asyncio, logging
+from typing import Union
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from modules.libraries.metrics import metrics, metrics_handler
+from modules.libraries.utils import const
+
+
+def create_app(dp: Dispatcher, bot: Bot, path: str, secret: Union[str, None] = None) -> web.Application:
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    app.router.add_get(const.METRICS_PATH, metrics_handler(metrics))
+    # Runs the dispatcher startup/shutdown hooks together with the app
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str,
+    url: Union[str, None] = None,
+    secret: Union[str, None] = None,
+):
+    runner = web.AppRunner(create_app(dp, bot, path, secret))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info(f"Serving webhook on http://{host}:{port}{path}")
+
+    # Behind a load balancer the webhook is registered once from outside, so url is optional.
+    # Extra instances run with --no-alerts and every instance with --redis, see main.parse_args
+    if url:
+        await bot.set_webhook(f"{url.rstrip('/')}{path}", secret_token=secret, drop_pending_updates=False)
+        logging.info(f"Registered webhook {url.rstrip('/')}{path}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,92 @@
+import asyncio, logging, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Tuple
+from modules.libraries.cache import forecast_cache
+from modules.libraries.forecast import CryptoTracker, precompute
+from modules.libraries.metrics import metrics
+from modules.libraries.utils import const
+
+
+class PoolBusy(Exception):
+    pass
+
+
+def run_forecast(symbol: str, interval: str, days_back: int) -> Tuple[str, bytes, int]:
+    tracker = CryptoTracker(symbol=symbol, interval=interval, days_back=days_back)
+    return tracker.run_analysis()
+
+
+class ForecastPool:
+
+    def __init__(self, workers: int = const.FORECAST_WORKERS, queue_size: int = const.FORECAST_QUEUE_SIZE):
+        self._workers = workers
+        self._queue_size = queue_size
+        self._executor = None
+        self._inflight = {}
+        self.pending = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn keeps the event loop and its threads out of the workers
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    @metrics.timed("forecast")
+    async def run(self, symbol: str, interval: str = "1d", days_back: int = 60) -> dict:
+        cached = forecast_cache.get(symbol, interval, days_back)
+        if cached is not None:
+            return cached
+
+        key = (symbol, interval, days_back)
+        task = self._inflight.get(key)
+        if task is None:
+            if self.pending >= self._workers + self._queue_size:
+                raise PoolBusy(f"{self.pending} forecasts already pending")
+            self.pending += 1
+            task = asyncio.create_task(self._compute(symbol, interval, days_back))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _compute(self, symbol: str, interval: str, days_back: int) -> dict:
+        try:
+            loop = asyncio.get_running_loop()
+            price, chart, last_candle = await loop.run_in_executor(self.executor, run_forecast, symbol, interval, days_back)
+        finally:
+            self.pending -= 1
+        return forecast_cache.put(symbol, interval, days_back, price, chart, last_candle)
+
+    @staticmethod
+    def missing(symbols: Iterable[str], interval: str = "1d", days_back: int = 60) -> list:
+        return sorted({symbol for symbol in symbols if not forecast_cache.has(symbol, interval, days_back)})
+
+    async def precompute(self, symbols: Iterable[str], interval: str = "1d", days_back: int = 60) -> int:
+        # Fills the cache for every symbol not cached for the current candle yet, in one job
+        missing = self.missing(symbols, interval, days_back)
+        if not missing:
+            return 0
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(self.executor, precompute, missing, interval, days_back)
+        finally:
+            self.pending -= 1
+        stored = 0
+        for symbol, (price, chart, last_candle) in results.items():
+            forecast_cache.put(symbol, interval, days_back, price, chart, last_candle)
+            stored += forecast_cache.fresh(interval, last_candle)
+        logging.info(f"Precomputed {len(results)} of {len(missing)} missing forecasts, {stored} cached")
+        return stored
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logging.info("Forecast pool shut down")
+
+
+forecast_pool = ForecastPool()